@@ -10,15 +10,20 @@ import sys
 import logging
 import http.server
 import socket
+import ssl
 import urllib3
 import urllib.parse
 import certifi
 import re
 import threading
-import queue
 import time
 import yaml
 import json
+import collections
+import hashlib
+import functools
+import concurrent.futures
+import gzip
 
 
 # Global log.
@@ -29,26 +34,466 @@ handler.setFormatter(logging.Formatter(
     "%(asctime)s.%(msecs)03d %(levelname)-5s %(message)s", "%Y-%m-%d %H:%M:%S"))
 log.addHandler(handler)
 
+# Regexes used for every request, compiled once. See get_query_parts, abbrev,
+# QueryProcessor.process_query, and do_GET for what they are used for.
+#
+# NOTE: I tried the re2 module (google-re2) for these, because it guarantees
+# linear time. But with its Python binding, it was 10 to 30 times slower than
+# re for our patterns (whitespace normalization, the predicate-exists regex,
+# and the whole-word regex, on a query of 100 KB). None of the patterns here
+# can backtrack badly anyway (the one big regex that could is gone, see
+# split_sparql_query).
+RE_PREFIX_SPLIT = re.compile(r"\s+(?=PREFIX)")
+RE_OPENING_PARENTHESIS_WS = re.compile(r"\(\s+")
+RE_CLOSING_PARENTHESIS_WS = re.compile(r"\s+\)")
+RE_SELECT_AS = re.compile(
+    r"\(\s*[^(]+\s*\([^)]+\)\s*[aA][sS]\s*(\?[^)]+)\s*\)")
+RE_TRAILING_DOT = re.compile(r"\s*\.?\s*$")
+RE_GROUP_BY = re.compile(r"^(?!GROUP BY$)(GROUP BY(?: \?\S*)*)(?: |$)(.*)$",
+                         re.IGNORECASE)
+# SPARQL keywords are case-insensitive, see split_sparql_query. We search with
+# a regex and not in query.upper(), because upper() can change the length of
+# the string (for example, for an ß), and then the positions would be off.
+RE_SELECT_KEYWORD = re.compile(r"SELECT\s", re.IGNORECASE)
+# The lines of the YAML with two queries that have to be indented, and what
+# they are replaced by (a LIMIT also starts the footer), see process_query.
+RE_YAML_INDENT = re.compile(r"\n(PREFIX|LIMIT|OFFSET)")
+YAML_INDENT_REPLACEMENTS = {
+        "PREFIX": "\n    PREFIX",
+        "LIMIT": "\n  footer: |-\n    LIMIT",
+        "OFFSET": "\n    OFFSET" }
+RE_YAML_KEY = re.compile(r"  (\w+): \|-")
+# Characters for which we leave the YAML to the real YAML parser (tabs, other
+# line breaks than \n, and the non-printable characters), see
+# parse_yaml_queries.
+RE_YAML_SPECIAL = re.compile(
+    "[^\n\x20-\x7E\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]|[\u2028\u2029]")
+# For the cache key of a query without string literals, see
+# QueryProcessor.response_cache_key. A # starts a comment unless it is inside
+# an IRI, and an IRI cannot contain whitespace.
+RE_SPARQL_COMMENT = re.compile(r"(?:^|(?<=\s))#[^\n]*")
+RE_PREFIX_DECLARATIONS = re.compile(r"^(?:PREFIX \S*: <[^>\s]*> )+")
+
+# YAML loader for the queries to the two backends. The C implementation (from
+# libyaml) is much faster than the pure-Python one, but it is only available
+# if PyYAML was built with libyaml.
+#
+# NOTE: Under PyPy, C extensions go through the slow cpyext emulation layer,
+# while the pure-Python loader is compiled by the JIT. So there we always
+# take the pure-Python one.
+if sys.implementation.name == "pypy":
+    YamlLoader = yaml.SafeLoader
+else:
+    YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Functions for parsing and producing JSON. If the orjson package is installed,
+# we use that, it is several times faster than the json module (which matters
+# for the check of each backend response in Response.__init__). Both parse
+# bytes directly, and json_dumps returns bytes (UTF-8) in both cases.
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    json_dumps = lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# Split a SPARQL query into the part before SELECT (the prefixes), the SELECT
+# clause, the body (inside the outer curly braces), and the footer (after the
+# last closing curly brace). The whitespace of each part is normalized. Returns
+# None if the query does not have that form.
+#
+# NEW: This used to be one big regex with two .*? and \S.*\S, which
+# backtracks a lot on large queries. The few str.find calls here do the same
+# in one pass. Note that the body ends at the *last* closing brace, so nested
+# braces (subqueries) are fine, just like before.
+#
+# NEW: The whitespace is now normalized here, for each of the four parts, and
+# no longer for the whole query first (in parse_sparql_query). This is about as
+# fast as before (the body, which is most of the query, is still copied twice:
+# by the slicing and by the normalization), but the query itself is now left
+# as it is, and there is only one place where whitespace is normalized.
+def split_sparql_query(query):
+    """
+    >>> split_sparql_query("PREFIX a: <b> SELECT ?x ?y WHERE { ?x a ?y } LIMIT 1")
+    ('PREFIX a: <b>', '?x ?y', '?x a ?y', 'LIMIT 1')
+    >>> split_sparql_query("SELECT ?x WHERE {{ ?x ?y ?z }}")
+    ('', '?x', '{ ?x ?y ?z }', '')
+    >>> split_sparql_query("SELECT * WHERE { ?x ?y ?z }") is None
+    True
+    >>> split_sparql_query("ASK { ?x ?y ?z }") is None
+    True
+    >>> split_sparql_query("prefix a: <b> select ?x where { ?x a ?y }")
+    ('prefix a: <b>', '?x', '?x a ?y', '')
+    >>> split_sparql_query("PREFIX a: <b>\\nSELECT\\n  ?x WHERE {\\n  ?x  a ?y\\n}\\n")
+    ('PREFIX a: <b>', '?x', '?x a ?y', '')
+    """
+    select_match = RE_SELECT_KEYWORD.search(query)
+    if select_match == None:
+        return None
+    select_pos = select_match.start()
+    open_pos = query.find("{", select_pos)
+    close_pos = query.rfind("}")
+    if open_pos == -1 or close_pos < open_pos:
+        return None
+    select_clause = query[select_pos + 7:open_pos].rstrip()
+    if select_clause[-5:].upper() != "WHERE":
+        return None
+    # NOTE: " ".join(s.split()) does the same as re.sub("\s+", " ", s).strip()
+    # (str.split and \s agree on what is whitespace), but several times faster.
+    select_clause = " ".join(select_clause[:-5].split())
+    body = " ".join(query[open_pos + 1:close_pos].split())
+    # The SELECT clause and the body have at least two characters, like the
+    # old regex demanded. In particular, "SELECT *" is not supported.
+    if len(select_clause) < 2 or len(body) < 2:
+        return None
+    return (" ".join(query[:select_pos].split()), select_clause, body,
+            " ".join(query[close_pos + 1:].split()))
+
+# Get the parts of a SPARQL query for the name service, see
+# QleverNameService.get_query_parts, which is the only caller.
+#
+# NOTE: The result used to be cached (with functools.lru_cache), because the
+# same queries come again and again. But that kept up to 1024 full query
+# strings (and their parts) in memory, no matter how long they are. Parsing a
+# query is cheap compared to the probe queries for it anyway.
+def parse_sparql_query(sparql_query):
+    """
+    >>> parse_sparql_query("PREFIX a: <b> SELECT ?x (COUNT(?y) AS ?c) WHERE {"
+    ...                    " ?x a:p ?y . } GROUP BY ?x LIMIT 3")
+    (('PREFIX a: <b>',), '?x (COUNT(?y) AS ?c)', ('?x', '?c'), '?x a:p ?y', 'GROUP BY ?x ', 'LIMIT 3')
+    >>> parse_sparql_query("ASK { ?x ?y ?z }") is None
+    True
+    """
+    # Get the query parts via split_sparql_query (see there). Their whitespace
+    # is normalized already.
+    query_parts = split_sparql_query(sparql_query)
+    if query_parts == None:
+        return None
+    prefix_string, select_vars_string, body_string, footer_string = \
+            query_parts
+    # NOTE: A PREFIX declaration that occurs more than once (with the same
+    # IRI) is only kept once. We use a dict and not a set for that, so that
+    # the order stays the same.
+    prefixes_tuple = tuple(dict.fromkeys(RE_PREFIX_SPLIT.split(prefix_string)))
+    select_vars_string = RE_OPENING_PARENTHESIS_WS.sub("(", select_vars_string)
+    select_vars_string = RE_CLOSING_PARENTHESIS_WS.sub(")", select_vars_string)
+    # For something like "( COUNT( ?y_2) AS ?yy)" extract "?yy".
+    select_vars_tuple = tuple(
+            RE_SELECT_AS.sub("\\1", select_vars_string).split())
+    body_string = RE_TRAILING_DOT.sub("", body_string)
+
+    # If there is a GROUP BY, we need to separate it from the footer. The
+    # GROUP BY clause consists of all the variables (?...) that follow.
+    # Note that the footer is already whitespace-normalized, and that we
+    # need at least one token after GROUP BY (that's the lookahead at the
+    # start of the regex). The regex is anchored, so for a footer without
+    # GROUP BY, it fails right away.
+    match = RE_GROUP_BY.match(footer_string)
+    if match != None:
+        group_by_string = match.group(1) + " "
+        footer_string = match.group(2)
+    else:
+        group_by_string = ""
+    return (prefixes_tuple, select_vars_string, select_vars_tuple,
+            body_string, group_by_string, footer_string)
+
+# Split the path of a SPARQL query to the proxy (which starts with /?query=)
+# into the SPARQL query (the value of the query parameter, unquoted) and the
+# other parameters (the rest of the path, starting with the first &, still
+# quoted). Note that & never occurs in the quoted value of the query parameter.
+def split_query_path(path):
+    """
+    >>> split_query_path("/?query=SELECT+%3Fx+WHERE+{}&name_service=true")
+    ('SELECT ?x WHERE {}', '&name_service=true')
+    >>> split_query_path("/?query=SELECT%20%3Fx")
+    ('SELECT ?x', '')
+    """
+    query_end = path.find("&")
+    if query_end == -1:
+        query_end = len(path)
+    return (urllib.parse.unquote_plus(path[len("/?query="):query_end]),
+            path[query_end:])
+
+# Does the given value of an Accept-Encoding header allow gzip? That is the
+# case if it lists gzip (or *, if gzip is not listed) with a q value that is
+# not 0. See RFC 9110, Section 12.5.3.
+def accepts_gzip(accept_encoding):
+    """
+    >>> accepts_gzip("gzip, deflate, br")
+    True
+    >>> accepts_gzip("deflate, GZIP;q=0.5")
+    True
+    >>> accepts_gzip("gzip;q=0, *")
+    False
+    >>> accepts_gzip("x-gzip-foo, br")
+    False
+    >>> accepts_gzip("br, *;q=0.1")
+    True
+    >>> accepts_gzip("")
+    False
+    """
+    q_values = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        q_value = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q_value = float(value)
+                except ValueError:
+                    q_value = 0.0
+        q_values[coding.strip().lower()] = q_value
+    return q_values.get("gzip", q_values.get("*", 0.0)) > 0
+
+# Parse the YAML with the two queries (after the substitutions in
+# QueryProcessor.process_query), which always has the same simple form: a
+# "yaml:" line, followed by keys (query_1, query_2, footer) with a literal block
+# scalar (|-) each. This is much faster than the YAML parser. Returns None if
+# the YAML is not of that form, the caller then has to use the YAML parser.
+def parse_yaml_queries(queries_yaml):
+    """
+    >>> queries = parse_yaml_queries("yaml:\\n  query_1: |-\\n    SELECT ?x {\\n"
+    ...   "      ?x <a> ?y }\\n  query_2: |-\\n    SELECT ?x { ?x <b> ?y }\\n"
+    ...   "  footer: |-\\n    LIMIT 10\\n")
+    >>> queries["query_1"], queries["query_2"], queries["footer"]
+    ('SELECT ?x {\\n  ?x <a> ?y }', 'SELECT ?x { ?x <b> ?y }', 'LIMIT 10')
+    >>> parse_yaml_queries("yaml:\\n  query_1: |-\\n  SELECT") is None
+    True
+    """
+    if RE_YAML_SPECIAL.search(queries_yaml):
+        return None
+    lines = queries_yaml.split("\n")
+    if lines[0] != "yaml:":
+        return None
+    blocks = {}
+    block = None
+    for line in lines[1:]:
+        match = RE_YAML_KEY.fullmatch(line)
+        if match != None:
+            if match.group(1) in blocks:
+                return None
+            block = blocks[match.group(1)] = []
+        elif block == None:
+            return None
+        else:
+            block.append(line)
+    queries = {}
+    for key, block in blocks.items():
+        # The indentation of a block is that of its first non-empty line. All
+        # other non-empty lines must have at least that indentation (otherwise,
+        # the block would end there, which is not the simple form from above).
+        # Lines with only spaces are empty lines, unless they have more spaces
+        # than the indentation and come after the first non-empty line.
+        first_line = next((line for line in block if line.strip(" ") != ""),
+                          None)
+        if first_line == None:
+            queries[key] = ""
+            continue
+        indent = len(first_line) - len(first_line.lstrip(" "))
+        if indent <= 2:
+            return None
+        indent_string = " " * indent
+        block_lines = []
+        for line in block:
+            if line.startswith(indent_string):
+                if line is first_line:
+                    first_line = None
+                elif first_line != None and len(line) > indent \
+                        and line.strip(" ") == "":
+                    return None
+                block_lines.append(line[indent:])
+            elif line.strip(" ") == "":
+                block_lines.append("")
+            else:
+                return None
+        # With |-, all line breaks at the end are removed.
+        queries[key] = "\n".join(block_lines).rstrip("\n")
+    return queries
+
 # Function for abbreviating long strings in log. When called with second
 # argument unquote=True, urldecode the string and replace sequences of whitspace
 # by a single space. When called with compact_ws=True, only do the latter.
 # space.
+#
+# NEW: Unquoting and compacting a long string (a SPARQL query can have 100 KB
+# and more) only to show 120 characters of it is a waste. So for a long
+# string, we first only look at a window at the beginning and one at the end.
+# Unquoting and compacting can only make a string shorter, so if what remains
+# of each window is still long enough, that's it (only the inner end of each
+# window can be different from the full string, for example, when an escape
+# sequence is cut in half, and we do not use that part). Otherwise, we take
+# the whole string, like before.
 def abbrev(long_string, **kwargs):
+    """
+    >>> abbrev("/?query=SELECT%20%3Fx%20%20WHERE", unquote=True, compact_ws=True)
+    '/?query=SELECT ?x WHERE'
+    >>> abbrev("/?query=" + "%3Fx%20%20%C3%A4" * 100, unquote=True)[:20]
+    '/?query=?x  ä?x  ä?x'
+    >>> abbrev(b'{"res": [' + b'["x"], ' * 1000 + '["ä"]]}'.encode(),
+    ...        max_length=40)
+    '{"res": [["x"], [" ... "], ["x"], ["ä"]]}'
+    """
     max_length = kwargs.get("max_length", 120)
-    # long_string = "\"" + long_string + "\""
-    if kwargs.get("unquote", False):
-        long_string = urllib.parse.unquote_plus(long_string)
-        # long_string = re.sub("\n", " ",
-        #         urllib.parse.unquote_plus(long_string)) # + " [unquoted]"
-    if kwargs.get("compact_ws", False):
-        long_string = re.sub("\s+", " ", long_string)
-        long_string = re.sub(" &", "&", long_string)
+    window_size = 4 * max_length
+    # NEW: For bytes (like the data of a response), we only decode the part
+    # that we might show (see below), and not all the data.
+    if isinstance(long_string, bytes):
+        if len(long_string) > 2 * window_size:
+            long_string = long_string[:window_size] + b" ... " \
+                              + long_string[-window_size:]
+        long_string = long_string.decode("utf-8", errors="replace")
+    if len(long_string) > 2 * window_size:
+        head = abbrev_prepare(long_string[:window_size], **kwargs)
+        tail = abbrev_prepare(long_string[-window_size:], **kwargs)
+        if len(head) >= max_length and len(tail) >= max_length:
+            k = max_length // 2 - 2
+            return "%s ... %s" % (head[:k], tail[-k:])
+    long_string = abbrev_prepare(long_string, **kwargs)
     if len(long_string) <= max_length:
         return long_string
     else:
         k = max_length // 2 - 2
         return "%s ... %s" % (long_string[:k], long_string[-k:])
+
+def abbrev_prepare(long_string, **kwargs):
+    """
+    The unquoting and compacting for abbrev, see there.
+    """
+    if kwargs.get("unquote", False):
+        long_string = urllib.parse.unquote_plus(long_string)
+        # long_string = re.sub("\n", " ",
+        #         urllib.parse.unquote_plus(long_string)) # + " [unquoted]"
+    if kwargs.get("compact_ws", False):
+        # NEW: str.split and str.replace instead of two regex substitutions
+        # (the same result, except that there is no space at the beginning or
+        # end anymore).
+        long_string = " ".join(long_string.split()).replace(" &", "&")
+    return long_string
    
+@functools.lru_cache(maxsize=1024)
+def renamed_vars_pattern(vars_tuple):
+    """
+    Compiled regex that matches each of the given variables as a whole word,
+    for example, ?x but not the prefix of ?xy. Cached, because the same
+    variable names occur again and again.
+
+    NEW: For several variables at once (it was one variable per regex before),
+    so that all of them can be renamed in a single pass, see enhance_query.
+
+    >>> renamed_vars_pattern(("?x", "?x_y")).sub(lambda match: match.group(0)
+    ...     + "_id", "?x a ?xy . ?x_y b ?x")
+    '?x_id a ?xy . ?x_y_id b ?x_id'
+    """
+    return re.compile(
+        "(?:%s)\\b" % "|".join(re.escape(var) for var in vars_tuple))
+
+
+def make_cache_key(*parts):
+    """
+    Key for an LruCache from the given strings (None is allowed, too). This is
+    a 16-byte BLAKE2 digest, so that we do not have to keep the (possibly long)
+    query strings in the cache and comparing keys is cheap. A part can also be
+    bytes, in particular, another key (to hash a long common part only once).
+
+    >>> make_cache_key("a", "bc") == make_cache_key("a", "bc")
+    True
+    >>> make_cache_key("a", "bc") == make_cache_key("ab", "c")
+    False
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes)
+                      else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.digest()
+
+
+class LruCache:
+    """
+    Simple thread-safe LRU cache, optionally with a time to live (TTL) for each
+    entry. Used for the probe results of the name service and for the
+    responses of the proxy.
+
+    >>> cache = LruCache(2)
+    >>> cache.put("a", 1); cache.put("b", 2); cache.get("a")
+    1
+    >>> cache.put("c", 3); cache.get("b") == None, len(cache)
+    (True, 2)
+    >>> cache.clear(), len(cache)
+    (2, 0)
+    >>> cache = LruCache(10, max_total_size=5)
+    >>> cache.put("a", b"abc", 3); cache.put("b", b"de", 2); cache.put("c", b"f", 1)
+    >>> cache.get("a") == None, cache.total_size
+    (True, 3)
+    """
+
+    def __init__(self, max_size, ttl_seconds=None, max_total_size=None):
+        """
+        Create empty cache with the given maximal number of entries. If
+        ttl_seconds is not None, entries older than that are ignored. If
+        max_total_size is not None, the sum of the sizes of the entries (see
+        put) is at most that, too.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_total_size = max_total_size
+        self.total_size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Get the value for the given key, or None if there is no such entry (or
+        it is too old). Marks the entry as most recently used.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return None
+            value, insertion_time, size = entry
+            if self.ttl_seconds != None \
+                    and time.monotonic() - insertion_time > self.ttl_seconds:
+                del self.entries[key]
+                self.total_size -= size
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=0):
+        """
+        Add the given entry (with the given size, for example, the number of
+        bytes of a response) and evict the least recently used entries while
+        the cache is too full.
+        """
+        with self.lock:
+            old_entry = self.entries.get(key)
+            if old_entry != None:
+                self.total_size -= old_entry[2]
+            self.entries[key] = (value, time.monotonic(), size)
+            self.entries.move_to_end(key)
+            self.total_size += size
+            while len(self.entries) > self.max_size or \
+                    (self.max_total_size != None and len(self.entries) > 0
+                     and self.total_size > self.max_total_size):
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.total_size -= evicted_size
+
+    def clear(self):
+        """
+        Remove all entries. Returns the number of entries removed.
+        """
+        with self.lock:
+            num_entries = len(self.entries)
+            self.entries.clear()
+            self.total_size = 0
+            return num_entries
+
+
 class QleverNameService:
     """
     Class for extending a SPARQL Query by adding name variables and triples. We
@@ -96,6 +541,14 @@ class QleverNameService:
             example, for predicate <http://www.wikidata.org/prop/direct/P18>,
             the default would be to search for triples with a predicate that
             either matches exactly this IRI or ends in :P18.
+
+            >>> config = QleverNameService.ConfigForAddTriple(
+            ...     "<http://www.wikidata.org/prop/direct/P18>", "_image", "-1")
+            >>> [match.group(1) for match in config.predicate_exists_pattern.finditer(
+            ...     "?x wdt:P18 ?i . ?y wdt:P180 ?j . ?z <http://www.wikidata.org/prop/direct/P18> ?k")]
+            ['?x', '?z']
+            >>> config.predicate_exists_text
+            'P18'
             """
 
             self.predicate = predicate
@@ -103,10 +556,31 @@ class QleverNameService:
             self.position = int(position)
             self.position_repeated = int(position)
             self.optional = kwargs.get("optional", False)
+            # NOTE: The replacement string used to be "\\\S+:\\\1" (not a raw
+            # string), which gave a regex that never matched (with a \x01 where
+            # the suffix should be), so only the full name was found. The
+            # (?!\S) is so that :P18 does not also match :P180.
             self.predicate_exists_regex = kwargs.get("predicate_exists_regex",
                     "(%s|%s)" % (predicate,
-                        re.sub("^.*[/#](.*)>", "\\\S+:\\\1", predicate)))
+                        re.sub(r"^.*[/#](.*)>", r"\\S+:\1(?!\\S)", predicate)))
+            # NEW: A string that occurs in every match of the default regex
+            # (the suffix of the predicate, like P18 above), or None if there
+            # is no such string that we know of. If it does not occur in the
+            # body of a query (which is the common case), we do not need to
+            # run the regex at all, see QleverNameService.enhance_query. The
+            # str.find for that is 20 times faster than the regex search. We
+            # only trust suffixes that are plain words, and predicates without
+            # a | (which would be an alternation in the regex).
+            self.predicate_exists_text = None
+            suffix_match = re.match(r"^.*[/#](\w+)>$", predicate)
+            if "predicate_exists_regex" not in kwargs and suffix_match != None \
+                    and "|" not in predicate:
+                self.predicate_exists_text = suffix_match.group(1)
             # print("Predicate exists REGEX: ", self.predicate_exists_regex)
+            # Compiled regex that finds all variables that already have the
+            # predicate, see QleverNameService.enhance_query.
+            self.predicate_exists_pattern = re.compile(
+                    r"(\?\w+)\s+" + self.predicate_exists_regex)
 
             # If so desired, add only for the first variable and replace
             # after the first.
@@ -144,13 +618,32 @@ class QleverNameService:
 
 
     def __init__(self, backend, subject_var_suffix,
-            configs_for_add_triple):
+            configs_for_add_triple, probe_cache_max_size=4096,
+            probe_cache_ttl_seconds=None):
         """
-        Create with given backend and config.
+        Create with given backend and config. The probe results are cached,
+        see probe_candidates, optionally only for the given number of seconds.
         """
         self.backend = backend
         self.subject_var_suffix = subject_var_suffix
         self.configs_for_add_triple = configs_for_add_triple
+        # Thread pool for asking the probe queries concurrently (created once
+        # and reused for all queries). No point in having more threads than
+        # connections in the pool of the backend.
+        self.probe_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=backend.max_pool_size if backend else 1,
+                thread_name_prefix="name-service")
+        # LRU cache for the results of the probe queries, see
+        # probe_candidates. The TTL is for when the data of the backend changes
+        # without anyone telling the proxy (via cmd=clear-cache).
+        self.probe_cache = LruCache(probe_cache_max_size,
+                                    probe_cache_ttl_seconds)
+        # How often the batched probe query failed while the single probe
+        # queries worked, see probe_candidates. After a few such failures, we
+        # assume that the backend cannot handle the batched query and stop
+        # trying (until the cache of the backend is cleared via the proxy).
+        self.num_batched_probe_failures = 0
+        self.max_batched_probe_failures = 3
 
     
     def get_query_parts(self, sparql_query):
@@ -180,54 +673,18 @@ class QleverNameService:
         >>> parts[5]
         'OFFSET 20 LIMIT 10'
         """
-        # Get the query parts via this nice regex. Make sure that there are no
-        # newline, or use the re.MULTILINE flag.
-        match_groups = re.match(
-            "^\s*(.*?)\s*SELECT\s+(\S[^{]*\S)\s*WHERE\s*{\s*(\S.*\S)\s*}\s*(.*?)\s*$",
-            re.sub("\s+", " ", sparql_query))
-        if match_groups == None or len(match_groups.groups()) != 4:
+        # NEW: The actual work is done by parse_sparql_query, which returns
+        # the parts as tuples. The callers get lists, which they can change.
+        query_parts = parse_sparql_query(sparql_query)
+        if query_parts == None:
             log.error("\x1b[31mProblem parsing SPARQL query\x1b[0m"
-                      "\x1b[90m\n%s\x1b[0m" % re.sub("\s*$", "", sparql_query))
-            if match_groups == None:
-                log.error("Parse regex does not match")
-            else:
-                log.error("Parse regex match groups: %s" % str(match_groups.groups()))
+                      "\x1b[90m\n%s\x1b[0m", sparql_query.rstrip())
             return None
-        prefixes_list = re.split("\s+(?=PREFIX)", match_groups.group(1))
-        select_vars_string = match_groups.group(2)
-        select_vars_string = re.sub("\(\s+", "(", select_vars_string)
-        select_vars_string = re.sub("\s+\)", ")", select_vars_string)
-        # For something like "( COUNT( ?y_2) AS ?yy)" extract "?yy".
-        select_vars_list = re.sub(
-            "\(\s*[^(]+\s*\([^)]+\)\s*[aA][sS]\s*(\?[^)]+)\s*\)", "\\1",
-            select_vars_string).split()
-        body_string = match_groups.group(3)
-        body_string = re.sub("\s+", " ", body_string)
-        body_string = re.sub("\s*\.?\s*$", "", body_string)
-        footer_string = match_groups.group(4)
-
-        # If there is a GROUP BY, we need to separate it from the footer.
-        #
-        # First split by whitespace, then check whether the first two tokens
-        # are GROUP BY and if yes, collect all variables (?...) that follow.
-        # This is kind of ugly, but it works. It would be nicer to do this
-        # with a proper regex. On the other hand, maybe that's not to
-        # differnt from how a "real" parser would do it.
-        footer_string_parts = footer_string.split()
-        if len(footer_string_parts) > 2 \
-                and footer_string_parts[0] == "GROUP" \
-                and footer_string_parts[1] == "BY":
-            group_by_string = "GROUP BY"
-            i = 2
-            while i < len(footer_string_parts) \
-                    and footer_string_parts[i].startswith("?"):
-                i += 1
-            group_by_string = " ".join(footer_string_parts[:i]) + " "
-            footer_string = " ".join(footer_string_parts[i:])
-        else:
-            group_by_string = ""
-        return [prefixes_list, select_vars_string, select_vars_list,
-                  body_string, group_by_string, footer_string]
+        prefixes_tuple, select_vars_string, select_vars_tuple, body_string, \
+                group_by_string, footer_string = query_parts
+        return [list(prefixes_tuple), select_vars_string,
+                list(select_vars_tuple), body_string, group_by_string,
+                footer_string]
 
 
     def make_sparql_query_from_parts(self,
@@ -238,6 +695,12 @@ class QleverNameService:
         from the return-statement, how the parts are synthesized. The arguments
         with suffix _list are lists, the other arguments are strings.
         """
+        # NOTE: The adjacent f-strings below are compiled into a single
+        # BUILD_STRING, which allocates the result once, with the right size.
+        # So there are no intermediate strings, and "".join over a list of the
+        # parts is not faster (I measured it, for a body of 100 KB). Also no
+        # need to special-case the lists with a single element (as for the
+        # probe queries): for those, join returns that element as it is.
         prefixes_string = "\n".join(prefixes_list)
         new_vars_string = " ".join(new_vars_list)
         new_triples_string = " .\n".join(new_triples_list)
@@ -249,6 +712,270 @@ class QleverNameService:
                f"}} {footer_string}"
 
 
+    def make_name_probe_query(self, prefixes_list, select_vars_string,
+            body_string, group_by_string, var, config):
+        """
+        Build the SPARQL query that checks whether adding the triple from the
+        given config for the given variable gives any result. Returns the query
+        and the triple that was tested (the latter is only used for logging).
+
+        TODO: Due to a current bug in PR#355 (as of 25.12.2020) when the inner
+        query has only a single triple, explicitly order the inner query by
+        {var}.
+        """
+        group_by_string_enhanced = group_by_string + f"ORDER BY {var} "
+        test_var = var + config.suffix + "_test"
+        test_triple = f"  {var} {config.predicate} {test_var}"
+        test_query = self.make_sparql_query_from_parts(
+            prefixes_list, [test_var], [test_triple],
+            select_vars_string, body_string, group_by_string_enhanced,
+            "LIMIT 1")
+        return test_query, test_triple
+
+
+    def make_batched_name_probe_query(self, prefixes_list, select_vars_string,
+            body_string, group_by_string, candidates):
+        """
+        Build a single SPARQL query that checks for all the given candidates (a
+        list of pairs of a variable and a ConfigForAddTriple) at once, whether
+        adding the respective triple gives any result. There is one UNION
+        branch per candidate, which is a LIMIT 1 subquery like the one from
+        make_name_probe_query, and which binds the index of the candidate to
+        ?qlever_proxy_probe. The result of the query therefore contains the
+        index of each candidate with a hit (and no other rows).
+
+        NOTE: I used UNION instead of one OPTIONAL per candidate on purpose, see
+        the TODO in enhance_query.
+
+        >>> qns = QleverNameService(None, None, None)
+        >>> config = QleverNameService.ConfigForAddTriple("rdfs:label", "_name", "1")
+        >>> print(qns.make_batched_name_probe_query(["PREFIX a: <bla>"],
+        ...     "?x ?y", "?x a:b ?y", "", [("?x", config), ("?y", config)]))
+        PREFIX a: <bla>
+        SELECT ?qlever_proxy_probe WHERE {
+          { { SELECT ?x_name_test WHERE {
+                { SELECT ?x ?y WHERE { ?x a:b ?y } ORDER BY ?x }
+                ?x rdfs:label ?x_name_test } LIMIT 1 }
+            BIND(0 AS ?qlever_proxy_probe) }
+          UNION
+          { { SELECT ?y_name_test WHERE {
+                { SELECT ?x ?y WHERE { ?x a:b ?y } ORDER BY ?y }
+                ?y rdfs:label ?y_name_test } LIMIT 1 }
+            BIND(1 AS ?qlever_proxy_probe) }
+        }
+        """
+        prefixes_string = "\n".join(prefixes_list)
+        # The inner query is the same for all branches (except for the ORDER
+        # BY), so build that part only once.
+        inner_query_string = f"        {{ SELECT {select_vars_string} WHERE" \
+                             f" {{ {body_string} }} {group_by_string}ORDER BY "
+        probe_branches = []
+        for candidate_index, (var, config) in enumerate(candidates):
+            test_var = var + config.suffix + "_test"
+            probe_branches.append(
+                f"  {{ {{ SELECT {test_var} WHERE {{\n"
+                f"{inner_query_string}{var} }}\n"
+                f"        {var} {config.predicate} {test_var} }} LIMIT 1 }}\n"
+                f"    BIND({candidate_index} AS ?qlever_proxy_probe) }}")
+        probe_branches_string = "\n  UNION\n".join(probe_branches)
+        return f"{prefixes_string}\n" \
+               f"SELECT ?qlever_proxy_probe WHERE {{\n" \
+               f"{probe_branches_string}\n" \
+               f"}}"
+
+
+    def probe_candidates(self, prefixes_list, select_vars_string,
+            body_string, group_by_string, candidates, headers):
+        """
+        For each of the given candidates (a list of pairs of a variable and a
+        ConfigForAddTriple) check whether adding the respective triple gives
+        any result. Returns a list of booleans, one per candidate.
+
+        The answer only depends on the inner query with its prefixes and the
+        triple (and the data of the backend, which rarely changes), so we
+        remember it in an LRU cache and only ask the backend for the candidates
+        not in the cache. The cache is cleared when the backend is asked to
+        clear its cache via the proxy, see QueryProcessor.query.
+        """
+        # NOTE: The inner query (which can be long) is the same for all
+        # candidates, so we hash it only once. The prefixes are part of the
+        # key, too: the same body means something else if, say, wd: is bound
+        # to a different IRI.
+        inner_query_key = make_cache_key("\n".join(prefixes_list),
+                                         select_vars_string, body_string,
+                                         group_by_string)
+        cache_keys = [make_cache_key(inner_query_key, var, config.predicate)
+                      for var, config in candidates]
+        results = [self.probe_cache.get(key) for key in cache_keys]
+        uncached_indices = [i for i, result in enumerate(results)
+                            if result == None]
+        log.info("Name Service: %d candidate(s), %d found in cache",
+                 len(candidates), len(candidates) - len(uncached_indices))
+        if len(uncached_indices) == 0:
+            return results
+        uncached_candidates = [candidates[i] for i in uncached_indices]
+
+        # Ask the backend, first with a single batched query (UNION of one
+        # branch per candidate, see make_batched_name_probe_query). Fallback:
+        # one probe query per candidate. These are independent of each other,
+        # so we ask them concurrently (the results come back in the original
+        # order).
+        #
+        # NOTE: For a single candidate, the batched query is just a more
+        # complicated version of the single probe query, so use the latter
+        # right away, in this thread (there is nothing to overlap and the hop
+        # to the pool only costs time).
+        probe = lambda candidate: self.probe_candidate(
+                prefixes_list, select_vars_string, body_string,
+                group_by_string, candidate[0], candidate[1], headers)
+        use_batched_probe = len(uncached_candidates) > 1 and \
+                self.num_batched_probe_failures < self.max_batched_probe_failures
+        if len(uncached_candidates) == 1:
+            uncached_results = [probe(uncached_candidates[0])]
+        elif use_batched_probe:
+            uncached_results = self.probe_candidates_batched(
+                    prefixes_list, select_vars_string, body_string,
+                    group_by_string, uncached_candidates, headers)
+        else:
+            uncached_results = None
+        if uncached_results == None:
+            # NEW: Like for the two backends (see query_backends_in_parallel),
+            # the first probe query is asked in this thread, which would
+            # otherwise just wait. Only the others go to the thread pool.
+            futures = [self.probe_executor.submit(probe, candidate)
+                       for candidate in uncached_candidates[1:]]
+            uncached_results = [probe(uncached_candidates[0])] + \
+                    [future.result() for future in futures]
+            # NEW: If the batched query failed, but the single ones worked,
+            # the problem is the batched query, and not the query of the
+            # caller or the backend being down. If that happens again and
+            # again, we no longer waste a round trip on the batched query.
+            #
+            # NOTE: The counter is shared by all requests, and without a lock,
+            # so it may be off by one. It's only a heuristic anyway.
+            if use_batched_probe and \
+                    any(result != None for result in uncached_results):
+                self.num_batched_probe_failures += 1
+                if self.num_batched_probe_failures \
+                        == self.max_batched_probe_failures:
+                    log.info("\x1b[31mName Service: batched probe query"
+                             " failed %d times, using only single probe"
+                             " queries from now on\x1b[0m",
+                             self.num_batched_probe_failures)
+
+        # Only remember proper answers from the backend (and not failed
+        # queries, which are None and count as False).
+        for i, result in zip(uncached_indices, uncached_results):
+            if result != None:
+                self.probe_cache.put(cache_keys[i], result)
+            results[i] = result == True
+        return results
+
+
+    def clear_probe_cache(self):
+        """
+        Clear the cache with the probe results (and forget about failed batched
+        probe queries).
+        """
+        num_entries = self.probe_cache.clear()
+        log.info("Name Service: cleared cache with %d probe result(s)",
+                 num_entries)
+        # The backend may have changed, too, so give the batched probe query
+        # another chance, see probe_candidates.
+        self.num_batched_probe_failures = 0
+
+
+    def probe_candidates_batched(self, prefixes_list, select_vars_string,
+            body_string, group_by_string, candidates, headers):
+        """
+        Ask the batched probe query from make_batched_name_probe_query and
+        return a list of booleans, one per candidate, saying whether adding the
+        respective triple gives a result. Returns None if something went wrong,
+        so that the caller can fall back to one probe query per candidate.
+        """
+        probe_query = self.make_batched_name_probe_query(prefixes_list,
+                select_vars_string, body_string, group_by_string, candidates)
+        log.debug("Batched probe query for %d candidate(s)\n\x1b[90m%s\x1b[0m",
+                  len(candidates), probe_query)
+        # We want the standard SPARQL JSON, no matter what the caller asked
+        # for, because we parse the result ourselves.
+        probe_headers = dict(headers)
+        probe_headers["Accept"] = "application/sparql-results+json"
+        try:
+            response = self.backend.query("/?",
+                probe_headers,
+                self.backend.timeout_seconds,
+                sparql_query=probe_query,
+                pin_results_override=False)
+            if response.http_response == None:
+                log.info("\x1b[31mBatched probe query failed, falling back to"
+                         " one probe query per variable\x1b[0m")
+                return None
+            result = json_loads(response.http_response.data)
+            hit_indices = set()
+            for binding in result["results"]["bindings"]:
+                hit_indices.add(int(binding["qlever_proxy_probe"]["value"]))
+            return [i in hit_indices for i in range(len(candidates))]
+        except Exception as e:
+            log.error("\x1b[31mCould not get result for batched probe query"
+                      "\x1b[0m")
+            log.error("Error message: %s", e)
+            log.error("Query was: %s", probe_query)
+            return None
+
+
+    def probe_candidate(self, prefixes_list, select_vars_string,
+            body_string, group_by_string, var, config, headers):
+        """
+        Check via a single SPARQL query whether adding the triple from the given
+        config for the given variable gives any result. This is the fallback
+        for when the batched probe query fails. Returns None if we did not get
+        a proper response from the backend.
+        """
+        test_query, test_triple = self.make_name_probe_query(prefixes_list,
+                select_vars_string, body_string, group_by_string, var, config)
+        log.debug("Test if adding \"%s\" gives result\n\x1b[90m%s\x1b[0m",
+                  test_triple, test_query)
+
+        # SPARQL query in a separate try block, so that we can give a specific
+        # error message for that. Make sure that the result and sub-results of
+        # this query are NOT pinned to the cahce.
+        #
+        # NEW: Like for the batched probe query, we ask for the standard SPARQL
+        # JSON, no matter what the caller asked for. It does not echo the
+        # query (so it is small, the query has LIMIT 1), and we do not depend
+        # on the format the caller wants (with CSV, say, we never found the
+        # result size).
+        probe_headers = dict(headers)
+        probe_headers["Accept"] = "application/sparql-results+json"
+        response = None
+        try:
+            response = self.backend.query("/?",
+                probe_headers,
+                self.backend.timeout_seconds,
+                sparql_query=test_query,
+                pin_results_override=False)
+        except Exception as e:
+            log.error("\x1b[31mCould not get result from backend\x1b[0m")
+            log.error("Error message: %s", e)
+            log.error("Query was: %s", test_query)
+            return None
+        # If proper response, check whether there is a result row (json_loads
+        # can parse the bytes directly, without decoding them first).
+        #
+        # NOTE: We only catch what can go wrong with the JSON (not valid JSON,
+        # which is a ValueError also for orjson, or not of the expected form).
+        # Anything else is a bug, which should not look like a failed probe.
+        if response != None and response.http_response != None:
+            try:
+                result = json_loads(response.http_response.data)
+                return len(result["results"]["bindings"]) > 0
+            except (ValueError, KeyError, TypeError) as e:
+                log.error("\x1b[31mCould not parse result of probe query"
+                          " (%s)\x1b[0m", e)
+                return None
+        return None
+
     def enhance_query(self, sparql_query, headers):
         """
         Enhance the query, so that in the result for each columns with an ID
@@ -289,7 +1016,7 @@ class QleverNameService:
         """
 
         log.info("\x1b[1mName Service: check which name triples can be added\x1b[0m")
-        start_time = time.time()
+        start_time = time.monotonic_ns()
 
         # Get the various parts of the query (some as lists, some as strings).
         query_parts = self.get_query_parts(sparql_query)
@@ -313,30 +1040,51 @@ class QleverNameService:
         # clearly had names. This even happened when I added only a single name
         # triple with OPTIONAL. Looks like a QLever bug to me.
         #
-        new_select_vars_list = select_vars_list.copy()
-        new_triples_list = []
-        num_vars_added = 0
-        num_triples_added_per_config = [0] * len(self.configs_for_add_triple)
+        # NEW: We now check property 2 for all candidates at once, using one
+        # UNION branch per candidate, see make_batched_name_probe_query. This
+        # saves one round trip to the backend per candidate. If that query
+        # fails for whatever reason, we fall back to one query per candidate.
+        #
+        # Note that it does not matter for these checks whether a variable is
+        # renamed later (see below), because the renaming is consistent.
+        #
+        # Some configs only apply to the select variable at a certain position
+        # (a negative position counts from the end). These positions only
+        # depend on the number of select variables, so we compute them once.
+        num_select_vars = len(select_vars_list)
+        select_variable_positions = [
+            config.select_variable_position
+                if config.select_variable_position == None
+                   or config.select_variable_position >= 0
+                else num_select_vars + config.select_variable_position
+            for config in self.configs_for_add_triple]
+        # For property 1, we first find all variables that already have a
+        # triple with the respective predicate, with one pass over the body
+        # per config (and not one per variable and config). No need for that
+        # pass if a config only applies to a position that this query does not
+        # have, or if the predicate cannot occur in the body at all (see
+        # ConfigForAddTriple.predicate_exists_text).
+        vars_with_predicate_per_config = [
+            set(match.group(1) for match
+                in config.predicate_exists_pattern.finditer(body_string))
+                if (position == None or 0 <= position < num_select_vars)
+                   and (config.predicate_exists_text == None
+                        or config.predicate_exists_text in body_string)
+                else set()
+            for config, position in zip(self.configs_for_add_triple,
+                                        select_variable_positions)]
+        candidates = []
         for var_index, var in enumerate(select_vars_list):
 
-            # Keep track of whether this variable has been renamed (renamed at
-            # most once) and the original name.
-            var_has_been_renamed = False
-            original_var = var
-
             # For each --add-triple configuration check if the corresponding
-            # triple should be added and if yes, add it.
+            # triple is a candidate for being added.
             for config_index, config in enumerate(self.configs_for_add_triple):
 
                 # Some configs only apply to select variables in certain
-                # positions.
-                if config.select_variable_position != None:
-                    select_variable_position = config.select_variable_position \
-                            if config.select_variable_position >= 0 \
-                            else len(select_vars_list) + \
-                                     config.select_variable_position
-                    if var_index != select_variable_position:
-                        continue
+                # positions (see above).
+                if select_variable_positions[config_index] != None \
+                        and var_index != select_variable_positions[config_index]:
+                    continue
 
                 # Add name_predicate_prefix if not already in list of prefixes
                 #
@@ -355,143 +1103,129 @@ class QleverNameService:
                 # First check property 1. The regex captures which predicates we
                 # count as name predicates when checking whether a "name triple"
                 # already exists. Feel free to extend this.
-                if re.search(re.sub("\?", "\\?", var) + "\\s+"
-                    + config.predicate_exists_regex, body_string) != None:
+                if var in vars_with_predicate_per_config[config_index]:
                     continue
 
-                # Now check property 2 via a SPARQL query (does it make sense to
-                # add a name triple for this variable). Make sure to take the
-                # current name of the variable (maybe it was renamed already).
-                # 
-                # TODO: Due to a current bug in PR#355 (as of 25.12.2020) when
-                # the inner query has only a single triple, explicitly order the
-                # inner query by {var}.
-                group_by_string_enhanced = group_by_string + f"ORDER BY {var} "
-                log.info("\x1b[35;1mEnhancing test query by \"ORDER BY {var}\""
-                         " to circumvent bug in current PR355"
-                         " (as of 25.12.2020)\x1b[0m")
-
-                test_var = var + config.suffix + "_test"
-                test_triple = f"  {var} {config.predicate} {test_var}"
-                test_query = self.make_sparql_query_from_parts(
-                    prefixes_list, [test_var], [test_triple],
-                    select_vars_string, body_string, group_by_string_enhanced,
-                    "LIMIT 1")
-                log.debug(f"Test if adding \"{test_triple}\" gives result"
-                          f"\n\x1b[90m{test_query}\x1b[0m")
-
-                # SPARQL query in a separate try block, so that we can give a
-                # specific error message for that. Make sure that the result and
-                # sub-results of this query are NOT pinned to the cahce.
-                response = None
-                try:
-                    response = self.backend.query("/?query=" +
-                        urllib.parse.quote(test_query),
-                        headers,
-                        self.backend.timeout_seconds,
-                        pin_results_override=False)
-                except Exception as e:
-                    log.error("\x1b[31mCould not get result from backend\x1b[0m")
-                    log.error("Error message: %s" % str(e))
-                    log.error("Query was: %s" % test_query)
-                    add_new_triple = False
-                # If proper response, check the result size.
-                if response != None and response.http_response != None:
-                    # log.info(f"\x1b[90mResponse data for {var} is %s\x1b[0m"
-                    #         % re.sub("(\s|\\\\n)+", " ",
-                    #             str(response.http_response.data.decode("utf-8"))))
-                    match = re.search("\"resultsize\"\s*:\s*(\d+)",
-                        response.http_response.data.decode("utf-8"))
-                    add_new_triple = True if match != None \
-                                      and len(match.groups()) > 0 \
-                                      and int(match.group(1)) > 0 \
-                                 else False
-                else:
-                    add_new_triple = False
-
-                # If both properties are fulfilled, add the new triple.
-                if add_new_triple:
-                    # Are we renaming the original variable?
-                    # 
-                    # Note: id_var was initialized to None above to make sure
-                    # that in case we test several triples for addition, the
-                    # variable name is changed only once.
-                    if self.subject_var_suffix != "" \
-                            and not var_has_been_renamed:
-                        var = original_var + self.subject_var_suffix
-                        log.info(f"Renaming {original_var} to {var}")
-                        new_select_vars_list[var_index + num_vars_added] = var
-                        # Replace all occurrences of the original variable (the
-                        # \\b is there to make sure that only whole-word matches
-                        # are replaced).
-                        original_var_regex = re.sub("\\?", "\\?", original_var) + "\\b"
-                        log.debug("Regex for re.sub is %s" % original_var_regex)
-                        body_string = re.sub(original_var_regex, var, body_string)
-                        group_by_string = re.sub(original_var_regex, var, group_by_string)
-                        select_vars_string = re.sub(original_var_regex, var,
-                                select_vars_string)
-                        var_has_been_renamed = True
-                    # The name of the new variable.
-                    new_var = original_var + config.suffix
-                    # The id variable and the new variable must not have the
-                    # same name.
-                    if var == new_var:
-                        log.info("\x1b[31mAppending _ to distinguish added "
-                                 "variable from original (you can specify a "
-                                 "better suffix in the --add-triples "
-                                 "argument)\x1b[0m")
-                        new_var = new_var + "_"
-                    # Add new triple
-                    new_triple = f"{var} {config.predicate} {new_var}"
-                    if config.optional:
-                        new_triple = f"OPTIONAL {{ {new_triple} }}"
-                    log.info("\x1b[0mAdding triple \"%s\"\x1b[0m"
-                            % re.sub("^\s+", "", new_triple))
-                    new_triples_list.append("  " + new_triple)
-                    # Get position argument depending on how many triples we
-                    # have already added for this config.
-                    if num_triples_added_per_config[config_index] == 0:
-                        position = config.position
-                    else:
-                        position = config.position_repeated
-                    # CASE 1: Replace the id variable by the name variable
-                    if position == 0:
-                        log.debug(f"Replacing id variable \"{var}\" "
-                                  f"by new variable \"{new_var}\"")
-                        new_select_vars_list[var_index + num_vars_added] = new_var
-                    # CASE 2: Keep the id variable, add the new variable. Do not
-                    # count variables appended to the end towards
-                    # num_vars_added.
-                    else:
-                        log.debug(f"Keeping id variable \"{var}\", "
-                                  f"adding new variable \"{new_var}\"")
-                        # Position +1 means right next to current position
-                        # Position -1 means last position, -2 second to last.
-                        if position > 0:
-                            num_vars_added += 1
-                            pos = var_index + num_vars_added + position - 1
-                        else:
-                            pos = len(new_select_vars_list) + position + 1
-                        new_select_vars_list.insert(pos, new_var)
-                    log.debug("\x1b[34mNew select var list: %s\x1b[0m" 
-                                % " ".join(new_select_vars_list))
-
-                    # Keep track of how many triples we add per predicate.
-                    num_triples_added_per_config[config_index] += 1
+                candidates.append((var_index, var, config_index, config))
+
+        # NEW: If there are no candidates (for example, because all variables
+        # already have a name triple), there is nothing to do, and we return
+        # the query unchanged (without asking the backend or rewriting it).
+        if len(candidates) == 0:
+            log.info("Name service: no candidate variables, query unchanged")
+            return sparql_query
 
+        # Now check property 2 via SPARQL (does it make sense to add a name
+        # triple for this variable).
+        add_new_triple_list = self.probe_candidates(
+                prefixes_list, select_vars_string, body_string,
+                group_by_string,
+                [(var, config) for _, var, _, config in candidates],
+                headers)
+
+        new_select_vars_list = select_vars_list.copy()
+        new_triples_list = []
+        num_vars_added = 0
+        num_triples_added_per_config = [0] * len(self.configs_for_add_triple)
+        # Keep track of which variables have been renamed (renamed at most
+        # once).
+        #
+        # NEW: The renaming in the strings happens after the loop, for all
+        # variables at once, see below.
+        renamed_var_indices = set()
+        renamed_vars = {}
+        for (var_index, original_var, config_index, config), add_new_triple \
+                in zip(candidates, add_new_triple_list):
+
+            # If both properties are fulfilled, add the new triple.
+            if not add_new_triple:
+                continue
+
+            # Are we renaming the original variable? Make sure that in case
+            # we add several triples for the same variable, the variable
+            # name is changed only once.
+            var = original_var
+            if self.subject_var_suffix != "":
+                var = original_var + self.subject_var_suffix
+                if var_index not in renamed_var_indices:
+                    log.info("Renaming %s to %s", original_var, var)
+                    new_select_vars_list[var_index + num_vars_added] = var
+                    renamed_vars[original_var] = var
+                    renamed_var_indices.add(var_index)
+            # The name of the new variable.
+            new_var = original_var + config.suffix
+            # The id variable and the new variable must not have the
+            # same name.
+            if var == new_var:
+                log.info("\x1b[31mAppending _ to distinguish added "
+                         "variable from original (you can specify a "
+                         "better suffix in the --add-triples "
+                         "argument)\x1b[0m")
+                new_var = new_var + "_"
+            # Add new triple
+            new_triple = f"{var} {config.predicate} {new_var}"
+            if config.optional:
+                new_triple = f"OPTIONAL {{ {new_triple} }}"
+            log.info("\x1b[0mAdding triple \"%s\"\x1b[0m", new_triple)
+            new_triples_list.append("  " + new_triple)
+            # Get position argument depending on how many triples we
+            # have already added for this config.
+            if num_triples_added_per_config[config_index] == 0:
+                position = config.position
+            else:
+                position = config.position_repeated
+            # CASE 1: Replace the id variable by the name variable
+            if position == 0:
+                log.debug("Replacing id variable \"%s\" by new variable \"%s\"",
+                          var, new_var)
+                new_select_vars_list[var_index + num_vars_added] = new_var
+            # CASE 2: Keep the id variable, add the new variable. Do not
+            # count variables appended to the end towards
+            # num_vars_added.
+            else:
+                log.debug("Keeping id variable \"%s\", adding new variable \"%s\"",
+                          var, new_var)
+                # Position +1 means right next to current position
+                # Position -1 means last position, -2 second to last.
+                if position > 0:
+                    num_vars_added += 1
+                    pos = var_index + num_vars_added + position - 1
+                else:
+                    pos = len(new_select_vars_list) + position + 1
+                new_select_vars_list.insert(pos, new_var)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("\x1b[34mNew select var list: %s\x1b[0m",
+                          " ".join(new_select_vars_list))
+
+            # Keep track of how many triples we add per predicate.
+            num_triples_added_per_config[config_index] += 1
+
+
+        # Replace all occurrences of the renamed variables, with one pass over
+        # each string for all of them (and not one per variable). This also
+        # makes sure that a variable is not renamed twice (for example, if
+        # there are ?x and ?x_id and both are renamed).
+        if len(renamed_vars) > 0:
+            renamed_vars_regex = renamed_vars_pattern(tuple(renamed_vars))
+            log.debug("Regex for re.sub is %s", renamed_vars_regex.pattern)
+            rename = lambda match: renamed_vars[match.group(0)]
+            body_string = renamed_vars_regex.sub(rename, body_string)
+            group_by_string = renamed_vars_regex.sub(rename, group_by_string)
+            select_vars_string = renamed_vars_regex.sub(rename,
+                                                        select_vars_string)
 
         # Add the name triples for the variables, where names exist.
         enhanced_query = self.make_sparql_query_from_parts(
                 prefixes_list, new_select_vars_list, new_triples_list,
                 select_vars_string, body_string, group_by_string, footer_string)
-        end_time = time.time()
+        end_time = time.monotonic_ns()
 
         # Log enhanced query (deactivated because the subsequent GET request is
         # also logged, so it's redundant here) and total time to compute it.
         # log.info("Name Service, result query: \x1b[90m%s\x1b[0m"
         #         % abbrev(enhanced_query, compact_ws=True))
         log.info("\x1b[1mTotal time spent on name service: %dms\x1b[0m",
-                 int(1000 * (end_time - start_time)))
+                 (end_time - start_time) // 1000000)
 
         return enhanced_query
 
@@ -508,30 +1242,60 @@ class Response:
     def __init__(self, **kwargs):
         """
         Three possible keywords arguments: http_response, query_path, error_msg.
+        And sparql_query, if the query was not in the query_path (but sent as
+        the body of a POST request, see Backend.query).
 
         NOTE: In a prior version http_response == None was taken as equivalent to
         error. However that was not correct because some QLever errors like
         "allocated more than the specified limit" lead to a http_response !=
         None but with an error message.
+
+        If is_streamed=True, the data of the http_response has not been read
+        yet (it was requested with preload_content=False), see stream_data.
+
+        The backend_id is the id of the backend that sent the http_response
+        (None if there is none), see QueryProcessor.query for why we need it.
         """
 
         self.http_response = kwargs.get("http_response", None)
-        self.error_data = None
+        self.is_streamed = kwargs.get("is_streamed", False)
+        self.backend_id = kwargs.get("backend_id", None)
+        self.backend_error_data = None
+        self.proxy_error_msg = None
+        self.sparql_query = None
         self.error_status_code = kwargs.get("status_code", 404)
-
-        # If http_response == None, create an error message.
+        # Optional function that is called with the complete data after it has
+        # been streamed, if it is not larger than on_complete_max_size (used
+        # for caching the response, see QueryProcessor.query).
+        self.on_complete = None
+        self.on_complete_max_size = 0
+        # Optional function that is called when a streamed response is done,
+        # whether all the data was streamed or not (after on_complete). It is
+        # called earlier if it is clear that on_complete will not be called
+        # (because the data is too large), and never more than once, see
+        # release.
+        self.on_release = None
+
+        # For a streamed response, we only look at the data if the status is
+        # not 200 (QLever passes the status code through, and an error
+        # response is small). Otherwise, we would have to read all the data
+        # here, which is exactly what we want to avoid.
+        if self.http_response != None and self.is_streamed:
+            if self.http_response.status == 200:
+                return
+            # Read the (small) error body into http_response.data, so that we
+            # can release the connection right away.
+            self.http_response.read(cache_content=True)
+            self.http_response.release_conn()
+            self.is_streamed = False
+
+        # If http_response == None, remember the error message. The JSON for
+        # the caller is only built when needed, see error_data.
         if self.http_response == None:
-            query_path = kwargs.get("query_path", "[no query path specified]")
-            error_msg = kwargs.get("error_msg", "[no error message specified]")
-            query = urllib.parse.parse_qs(query_path[2:]).get("query",
-                    "[no query specified]")
-            error_msg = "QLever Proxy error: %s" % error_msg
-            self.error_data = json.dumps({
-                    "query": query,
-                    "status": "ERROR",
-                    "resultsize": "0",
-                    "time": { "total": "0ms", "computeResult": "0ms" },
-                    "exception": error_msg }).encode("utf-8")
+            self.query_path = kwargs.get("query_path", "[no query path specified]")
+            self.sparql_query = kwargs.get("sparql_query", None)
+            self.proxy_error_msg = kwargs.get("error_msg",
+                                              "[no error message specified]")
 
         # If http_response.data == "status": "ERROR" then set http_response to
         # None and set error_data instead.
@@ -539,19 +1303,197 @@ class Response:
         # NOTE: Alternatively, we could have create an http_response object with
         # "status": "ERROR" in the case of an error, but I could not figure out
         # how to create an http_response object.
-        if self.http_response != None:
+        #
+        # NOTE: Not needed for a CachedHTTPResponse, we only cache responses
+        # without an error.
+        #
+        # NEW: We first search the bytes for "ERROR" (which is fast), and only
+        # if it's there parse the JSON. Before, we parsed the JSON of every
+        # response here, also of large results (and of the probe queries of the
+        # name service, which then parsed them again).
+        if self.http_response != None \
+                and not isinstance(self.http_response, CachedHTTPResponse) \
+                and b'"ERROR"' in self.http_response.data:
             try:
-                result = json.loads(self.http_response.data.decode("utf-8"))
+                result = json_loads(self.http_response.data)
                 if result.get("status") == "ERROR":
                     error_msg = result.get("exception", "[error msg not found]")
-                    log.info("\x1b[31mQLever response with ERROR: "
-                            + re.sub("\s+", " ", error_msg) + "\x1b[0m")
-                    self.error_data = self.http_response.data
+                    if log.isEnabledFor(logging.INFO):
+                        log.info("\x1b[31mQLever response with ERROR: %s\x1b[0m",
+                                 " ".join(error_msg.split()))
+                    self.backend_error_data = self.http_response.data
                     self.error_status_code = self.http_response.status
                     self.http_response = None
             except Exception as e:
-                log.info("\x1b[31mCould not parse QLever result ("
-                             + str(e) + ")\x1b[0m")
+                log.info("\x1b[31mCould not parse QLever result (%s)\x1b[0m",
+                         e)
+
+    @property
+    def error_data(self):
+        """
+        The data of the error response for the caller, or None if there was no
+        error. This is either the error JSON from the backend, or a JSON of the
+        same form that we build here from the error message of the proxy.
+
+        >>> json.loads(Response(query_path="/?query=SELECT+%3Fx&timeout=5",
+        ...                     error_msg="Timeout").error_data)["query"]
+        ['SELECT ?x']
+        >>> Response(query_path="/?cmd=stats").error_data[:31]
+        b'{"query":"[no query specified]"'
+        """
+        if self.backend_error_data != None:
+            return self.backend_error_data
+        if self.proxy_error_msg == None:
+            return None
+        # NOTE: As before (with parse_qs), the query is a list with one
+        # element.
+        if self.sparql_query != None:
+            query = [self.sparql_query]
+        elif self.query_path.startswith("/?query="):
+            query = [split_query_path(self.query_path)[0]]
+        else:
+            query = "[no query specified]"
+        return json_dumps({
+                "query": query,
+                "status": "ERROR",
+                "resultsize": "0",
+                "time": { "total": "0ms", "computeResult": "0ms" },
+                "exception": "QLever Proxy error: %s" % self.proxy_error_msg })
+
+    def discard(self):
+        """
+        For a streamed response whose data we do not want: close the
+        connection (reading all the data would take longer, and the data can
+        be large) and give it back to the pool (which opens a new connection
+        in its place when needed).
+        """
+        if self.is_streamed and self.http_response != None:
+            self.http_response.close()
+            self.http_response.release_conn()
+            self.release()
+
+    def release(self):
+        """
+        Call on_release (if there is one), but only the first time.
+        """
+        on_release, self.on_release = self.on_release, None
+        if on_release != None:
+            on_release()
+
+    def is_gzipped(self):
+        """
+        Is this a streamed response with gzip'ed data from the backend (which
+        stream_data can pass on as it is, see there)?
+        """
+        return self.is_streamed and \
+                self.http_response.getheader("Content-Encoding") == "gzip"
+
+    def content_length(self, decode_content=True):
+        """
+        Length of the data that stream_data yields, or None if we do not know
+        it in advance. For a streamed response, this is the Content-Length of
+        the backend, but not if the data is compressed and decode_content=True
+        (urllib3 decompresses it for us, so the length is then a different
+        one).
+        """
+        if not self.is_streamed:
+            return len(self.http_response.data)
+        if decode_content and \
+                self.http_response.getheader("Content-Encoding") != None:
+            return None
+        content_length = self.http_response.getheader("Content-Length")
+        return int(content_length) if content_length != None else None
+
+    def stream_data(self, chunk_size=262144, decode_content=True):
+        """
+        Generator for the data of the http_response, in chunks. For a response
+        that is not streamed, this is just the data. For a streamed response,
+        the data is read from the backend chunk by chunk, so that we can
+        forward it to the caller without keeping all of it in memory, and the
+        connection is returned to the pool in the end.
+
+        If decode_content=False, the data of a streamed response is passed on
+        as it comes from the backend (for example, gzip'ed, see is_gzipped).
+        The data for on_complete is always decompressed.
+
+        NOTE: The chunk size was 64 KB. With 256 KB, there are fewer rounds
+        through urllib3 and fewer writes to the caller, which for a large
+        result saves about a quarter of the CPU time spent here (I measured
+        it for a result of 64 MB). Larger chunks did not help any more.
+        """
+        if not self.is_streamed:
+            yield self.http_response.data
+            return
+        # NOTE: The data for on_complete is collected in a single bytearray.
+        # With a list of chunks, joined at the end, we had both the chunks and
+        # the joined data in memory at that point, that is, twice the data.
+        collected_data = bytearray()
+        collect_chunks = self.on_complete != None
+        is_complete = False
+        try:
+            for chunk in self.http_response.stream(
+                    chunk_size, decode_content=decode_content):
+                if collect_chunks:
+                    collected_data += chunk
+                    if len(collected_data) > self.on_complete_max_size:
+                        collect_chunks = False
+                        collected_data = None
+                        # Nobody has to wait for on_complete now (the rest
+                        # of the data can take a while).
+                        self.release()
+                yield chunk
+            is_complete = True
+            if collect_chunks:
+                data = collected_data
+                if not decode_content and self.is_gzipped():
+                    data = gzip.decompress(data)
+                if len(data) <= self.on_complete_max_size:
+                    self.on_complete(data)
+        finally:
+            # NOTE: If we stopped in the middle (for example, because the
+            # caller closed the connection), the rest of the data is still on
+            # the way. A connection in that state must not be reused for the
+            # next request (keep-alive), so we close it, like in discard.
+            if not is_complete:
+                self.http_response.close()
+            self.http_response.release_conn()
+            self.release()
+
+
+# The headers of a backend response that we forward to the caller, see do_GET
+# in MakeRequestHandler. These are also the only headers that we keep for a
+# cached response, see CachedHTTPResponse.
+HEADERS_PRESERVED = ("Content-Type", "Access-Control-Allow-Origin")
+
+
+class CachedHTTPResponse:
+    """
+    Copy of the parts of a HTTPResponse that we need for sending it to the
+    caller (status, headers, data). Unlike a HTTPResponse, this can be used
+    again and again, so this is what we put in the response cache of the
+    QueryProcessor.
+
+    NEW: Of the headers, we only keep those that we forward (HEADERS_PRESERVED,
+    with exactly these names), and not a copy of all of them for every cached
+    response.
+    """
+
+    def __init__(self, http_response, data=None):
+        """
+        If data is None, take it from the http_response (for a streamed
+        response, it has to be passed explicitly, and it is then a bytearray,
+        see Response.stream_data; we never change it).
+        """
+        self.status = http_response.status
+        self.headers = {}
+        for header_key in HEADERS_PRESERVED:
+            header_value = http_response.headers.get(header_key)
+            if header_value != None:
+                self.headers[header_key] = header_value
+        self.data = data if data != None else http_response.data
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
 
 
 class Backend:
@@ -564,9 +1506,13 @@ class Backend:
     """
 
     def __init__(self, backend_url, timeout_seconds, backend_id,
-            pin_results=False, clear_cache=False, show_cache_stats=True):
+            pin_results=False, clear_cache=False, show_cache_stats=True,
+            max_pool_size=16, shared_backend=None):
         """
         Create HTTP connection pool for asking request to this backend.
+
+        If shared_backend is another Backend with the same host and port, use
+        its connection pool instead of creating a new one.
         """
 
         backend_url_parsed = urllib.parse.urlparse(backend_url)
@@ -582,49 +1528,133 @@ class Backend:
         self.pin_results = pin_results
         self.clear_cache = clear_cache
         self.always_show_cache_stats = show_cache_stats
+        # NOTE: The prefix for all our log messages is made once here, and
+        # not for every query (and every log call) again.
         self.log_prefix = "Backend %d:" % self.backend_id
 
         # Values copied from eval.py from the QLever evaluation ... needed here?
-        max_pool_size = 4
-        self.connection_pool = urllib3.HTTPSConnectionPool(
-            self.host, port=self.port, maxsize=max_pool_size,
-            timeout=urllib3.util.Timeout(connect=self.timeout_seconds,
-                                         read=self.timeout_seconds),
-            retries=urllib3.Retry(total=0,
-                                  status_forcelist=[404, 503],
-                                  backoff_factor=0.1),
-            cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+        #
+        # NEW: The pool size was 4, which is too small now that the probe
+        # queries of the name service can be asked concurrently and the proxy
+        # has several worker threads, see --max-workers.
+        #
+        # NEW: By default, Backend 2 is the same as Backend 1 (and it is the
+        # backend of the name service). Then both share one pool, so that a
+        # connection opened for one (with its TLS handshake) can be reused by
+        # the other. The default timeout of a shared pool is that of Backend 1,
+        # so every request of this class must pass its own timeout (see
+        # query, show_cache_stats, and the clear-cache request below).
+        self.max_pool_size = max_pool_size
+        if shared_backend != None and \
+                (shared_backend.host, shared_backend.port) == (self.host, self.port):
+            self.connection_pool = shared_backend.connection_pool
+        else:
+            # NOTE: With block=False (which is also the default of urllib3),
+            # a request that finds the pool empty does not wait but opens an
+            # additional connection, which is discarded afterwards (urllib3
+            # then warns "Connection pool is full"). That's what we want for a
+            # burst of requests, but it costs a TLS handshake each time, which
+            # is why main sizes the pool by the number of worker threads.
+            #
+            # NEW: All connections of the pool use the same SSLContext, with
+            # the CA certificates loaded once here. With ca_certs=... (as
+            # before), urllib3 creates a new context for every new connection
+            # and parses the whole certifi bundle again, which took 20ms.
+            ssl_context = urllib3.util.create_urllib3_context(
+                    cert_reqs=ssl.CERT_REQUIRED)
+            ssl_context.load_verify_locations(certifi.where())
+            self.connection_pool = urllib3.HTTPSConnectionPool(
+                self.host, port=self.port, maxsize=self.max_pool_size,
+                block=False,
+                timeout=urllib3.util.Timeout(connect=self.timeout_seconds,
+                                             read=self.timeout_seconds),
+                retries=urllib3.Retry(total=0,
+                                      status_forcelist=[404, 503],
+                                      backoff_factor=0.1),
+                cert_reqs='CERT_REQUIRED', ssl_context=ssl_context)
+
+        # Headers sent with every query, made once here. Ask for keep-alive
+        # explicitly, see the comment in query, and for a gzip'ed response
+        # (the JSON results of QLever compress very well). urllib3 decompresses
+        # it for us, both for response.data and for response.stream, so the
+        # rest of this script (and the caller of the proxy) sees plain data.
+        self.default_headers = urllib3.make_headers(
+                keep_alive=True, accept_encoding="gzip")
+
+        # NEW: The cache statistics after a query (see query) are asked for by
+        # a separate thread, so that the response to the query does not wait
+        # for another round trip to the backend. One thread is enough, and
+        # there is never more than one such request waiting (there is no
+        # point in asking for the statistics several times in a row).
+        self.cache_stats_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="cache-stats")
+        self.cache_stats_pending = False
+        self.cache_stats_lock = threading.Lock()
+
+        # Queries with a longer path are sent as POST instead of GET, see
+        # query. Many web servers (and proxies) in front of a backend reject
+        # URLs longer than 8 KB.
+        self.max_get_path_length = 4096
 
         # Optionally clear the cache initially.
         if self.clear_cache:
             clear_cache_fields = { "cmd": "clear-cache-complete" }
             clear_cache_response = self.connection_pool.request(
-                'GET', self.base_path, fields=clear_cache_fields)
-            assert(clear_cache_response.status == 200)
+                'GET', self.base_path, fields=clear_cache_fields,
+                timeout=self.timeout_seconds)
+            # NOTE: This used to be an assert, which is gone with python -O
+            # (and then the proxy would claim below that the cache was
+            # cleared).
+            if clear_cache_response.status != 200:
+                raise RuntimeError("%s Clearing the cache of %s:%d failed"
+                                   " (HTTP status %d)" % (self.log_prefix,
+                                   self.host, self.port,
+                                   clear_cache_response.status))
 
         # Log what we have created.
         log.info("%s %s:%d%s with timeout %4.1fs%s", self.log_prefix,
              self.host, self.port, self.base_path, timeout_seconds,
              " [cache completely cleared]" if self.clear_cache else "")
 
-    def query_and_write_to_queue(self, query_path, headers, timeout, queue):
-        """ 
-        Like method query below, but append response to given queue (along with
-        the backend id, so that we know which result comes from with backend).
-        
-        Note that queue.put automatically locks the queue during appending so
-        that appends from different threads are serialized and don't interfere
-        with each other.
-        """
-        response = self.query(query_path, headers, timeout)
-        queue.put((response, self.backend_id))
+        # Resolve the host name once now, so that a problem with it shows up
+        # right at the start and not with the first query.
+        #
+        # NOTE: We do not use the resolved address for the connections (that
+        # would require a custom connection class for the TLS host name, and
+        # the address could change while the proxy is running). Since the
+        # connections in the pool are kept alive, the host name is resolved
+        # only when a new connection is opened, which is rare.
+        try:
+            addresses = sorted(set(info[4][0] for info in socket.getaddrinfo(
+                self.host, self.port, type=socket.SOCK_STREAM)))
+            log.info("%s %s resolves to %s", self.log_prefix, self.host,
+                     ", ".join(addresses))
+        except socket.gaierror as e:
+            log.error("%s Could not resolve host name %s (%s)",
+                      self.log_prefix, self.host, str(e))
+
+    # URL parameters for pinning the result of a query to the cache, see
+    # Backend.query below.
+    pin_results_params = "&pinresult=true&pinsubtrees=true"
 
     def query(self, query_path, headers, timeout, **kwargs):
         """ 
         Sent a GET request to the QLever backend, with the given path (which
-        should always start with a / even if it's a relative path).
+        should always start with a / even if it's a relative path). If the path
+        is very long, send a POST request instead, see below.
         
         If never_pin_result=True, override self.pin_results.
+
+        If sparql_query is given, send that query as the body of a POST request
+        (with Content-Type application/sparql-query), and the parameters from
+        the path (which should then start with /? and not contain a query
+        parameter) in the URL. That way, the query does not have to be quoted
+        at all, which takes time for a long query.
+
+        If stream=True, do not read the data of the response yet, see
+        Response.stream_data. The caller must then consume the data (or call
+        release_conn on the http_response), otherwise the connection is not
+        returned to the pool.
         """
 
         # Pin result to cache if self.pin_results.
@@ -634,7 +1664,7 @@ class Backend:
         # reason is that these queries are arbitrary and the subtree results can
         # be huge. In contrast, the large subtree results for the agnostic
         # queries all come from a very small set.
-        pin_results_params = "&pinresult=true&pinsubtrees=true" \
+        pin_results_params = self.pin_results_params \
             if kwargs.get("pin_results_override", self.pin_results) else ""
 
         # Add timeout parameter.
@@ -649,57 +1679,125 @@ class Backend:
         # we cannot simply append with "?..." (which is what fields=... does).
         full_path = self.base_path + query_path + pin_results_params + timeout_param
         full_path = self.normalize_query(full_path)
-        log.info("%s Sending GET request [unquoted and whitespace compressed]:"
-                 "\n\x1b[90m%s\x1b[0m" % (self.log_prefix,
-                     abbrev(full_path, compact_ws=True, unquote=True)))
+        sparql_query = kwargs.get("sparql_query", None)
+        if sparql_query != None:
+            full_path = full_path.replace("?&", "?", 1)
+        # NOTE: The arguments of a log call are evaluated even when the log
+        # level is such that nothing is logged, so we check first when an
+        # argument is expensive to compute (like abbrev of a long query).
+        if log.isEnabledFor(logging.INFO):
+            if sparql_query != None:
+                log.info("%s Sending POST request to %s"
+                         " [whitespace compressed]:\n\x1b[90m%s\x1b[0m",
+                         self.log_prefix, full_path,
+                         abbrev(sparql_query, compact_ws=True))
+            else:
+                log.info("%s Sending %s request [unquoted and whitespace compressed]:"
+                         "\n\x1b[90m%s\x1b[0m", self.log_prefix,
+                         "POST" if len(full_path) > self.max_get_path_length
+                             else "GET",
+                         abbrev(full_path, compact_ws=True, unquote=True))
 
         try:
-            # TODO: Understand why we need keep_alive=False?
-            # headers = urllib3.make_headers(keep_alive=False)
-            response = self.connection_pool.request('GET', full_path,
-                    fields=None, headers=headers, timeout=timeout)
+            # NOTE: We do not set keep_alive=False (as an earlier version did
+            # via urllib3.make_headers), so that the connection stays open
+            # after the request and the next request (for example, the next
+            # probe query of the name service) can reuse it from the pool,
+            # without a new TCP connection and TLS handshake.
+            stream = kwargs.get("stream", False)
+            # NEW: A long query (for example, one enhanced by the name
+            # service) is sent as a POST request, with the URL parameters as
+            # they are (already quoted) in the body. That way, we do not run
+            # into limits for the length of the URL. Short queries are still
+            # sent as GET, which is easier to read in the logs of the backend.
+            if sparql_query != None:
+                response = self.connection_pool.urlopen('POST', full_path,
+                        body=sparql_query.encode("utf-8"),
+                        headers={**self.default_headers, **headers,
+                            "Content-Type": "application/sparql-query"},
+                        timeout=timeout,
+                        preload_content=not stream)
+            elif len(full_path) > self.max_get_path_length \
+                    and "?" in full_path:
+                path, _, body = full_path.partition("?")
+                response = self.connection_pool.urlopen('POST', path,
+                        body=body, headers={**self.default_headers, **headers,
+                            "Content-Type": "application/x-www-form-urlencoded"},
+                        timeout=timeout,
+                        preload_content=not stream)
+            # NOTE: We call urlopen directly (like for the POST requests)
+            # and not request, which only dispatches to urlopen anyway (with
+            # fields=None, there is nothing to encode). The path starts with
+            # a /, so urllib3 does not parse it as a URL again and the
+            # request goes to the host of our pool without further checks.
+            else:
+                response = self.connection_pool.urlopen('GET', full_path,
+                        headers={**self.default_headers, **headers},
+                        timeout=timeout,
+                        preload_content=not stream)
             # NEW 27.01.2022: No need to restrict to certain status codes, since
             # the status code is passed through now.
             # assert(response.status == 200 or response.status == 400)
-            log.debug("%s Response data: %s", self.log_prefix,
-                abbrev(str(response.data), max_length=500, compact_ws=True))
-            # log.debug("Content type  : %s", response.getheader("Content-Type"))
-            # log.debug("All headers   : %s", response.getheaders())
+            if not stream and log.isEnabledFor(logging.DEBUG):
+                log.debug("%s Response data: %s", self.log_prefix,
+                    abbrev(response.data, max_length=500, compact_ws=True))
+            # NEW: The headers of the response, too (this was commented out,
+            # because the arguments were computed also when not logging).
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("%s Response headers: %s", self.log_prefix,
+                          " | ".join("%s: %s" % header
+                                     for header in response.headers.items()))
 
             # If query successful and we pinned the result, output cache stats.
             # If args.show_cache_stats_2, always show it. If
             # pin_results_override is set and False, never show it.
             if (self.pin_results or self.always_show_cache_stats) \
                     and kwargs.get("pin_results_override", True) == True:
-                self.show_cache_stats()
+                self.show_cache_stats_in_background()
 
-            return Response(http_response=response)
+            return Response(http_response=response, is_streamed=stream,
+                            backend_id=self.backend_id)
         except socket.timeout as e:
             error_msg = "%s Timeout (socket.timeout) after %.1f seconds" \
                     % (self.log_prefix, timeout)
             log.info(error_msg)
             return Response(query_path=query_path,
+                            sparql_query=sparql_query,
                             error_msg=error_msg,
-                            status_code=500)
+                            status_code=504)
         except urllib3.exceptions.ReadTimeoutError as e:
             error_msg = "%s Timeout (ReadTimeoutError) after %.1f seconds" \
                     % (self.log_prefix, timeout)
             log.info(error_msg)
             return Response(query_path=query_path,
+                            sparql_query=sparql_query,
                             error_msg=error_msg,
-                            status_code=500)
+                            status_code=504)
         except urllib3.exceptions.MaxRetryError as e:
-            error_msg = "%s Timeout (MaxRetryError) after %.1f seconds" \
-                    % (self.log_prefix, timeout)
+            # NOTE: Since we do not retry, any error of the connection ends up
+            # here, not only a timeout (for example, also when the backend is
+            # down). For the caller, these are 504 and 502, respectively. Note
+            # that for urllib3, a NewConnectionError is also a TimeoutError.
+            if isinstance(e.reason, urllib3.exceptions.TimeoutError) and \
+                    not isinstance(e.reason, urllib3.exceptions.NewConnectionError):
+                error_msg = "%s Timeout (MaxRetryError) after %.1f seconds" \
+                        % (self.log_prefix, timeout)
+                status_code = 504
+            else:
+                error_msg = "%s Error with request to %s (%s)" \
+                        % (self.log_prefix, self.host, str(e.reason))
+                status_code = 502
             log.info(error_msg)
             return Response(query_path=query_path,
+                            sparql_query=sparql_query,
                             error_msg=error_msg,
-                            status_code=500)
+                            status_code=status_code)
         except Exception as e:
             error_msg = "%s Error with request to %s (%s)" \
                     % (self.log_prefix, self.host, str(e))
             log.info(error_msg)
-            return Response(query_path=query_path, error_msg=error_msg)
+            return Response(query_path=query_path, sparql_query=sparql_query,
+                            error_msg=error_msg, status_code=502)
 
 
     def normalize_query(self, query):
@@ -725,17 +1823,51 @@ class Backend:
         return query
         
 
+    def show_cache_stats_in_background(self):
+        """
+        Like show_cache_stats, but in the thread of cache_stats_executor, so
+        that the caller does not have to wait for it. If there is already a
+        request for the cache statistics waiting, do nothing.
+        """
+        with self.cache_stats_lock:
+            if self.cache_stats_pending:
+                return
+            self.cache_stats_pending = True
+
+        def show_cache_stats_now():
+            with self.cache_stats_lock:
+                self.cache_stats_pending = False
+            self.show_cache_stats()
+        self.cache_stats_executor.submit(show_cache_stats_now)
+
     def show_cache_stats(self):
+        """
+        Log the cache statistics of the backend. If something goes wrong, log
+        that, too, but nothing else happens (this is called from query, and the
+        response to the query should not suffer from it).
+        """
         try:
-            # Get the response and throw exception if status != 200.
+            # Get the response.
+            #
+            # NEW: A status other than 200 is a normal branch now, and not an
+            # assert (which is gone with python -O, and which raised an
+            # exception only for us to catch it right away).
             cache_stats_fields = { "cmd": "cache-stats" }
             cache_stats_response = self.connection_pool.request(
                 'GET', self.base_path, fields=cache_stats_fields,
                 timeout=self.timeout_seconds)
-            assert(cache_stats_response.status == 200)
+            if cache_stats_response.status != 200:
+                log.info("%s Error getting cache statistics from %s:%d"
+                         " (HTTP status %d)", self.log_prefix, self.host,
+                         self.port, cache_stats_response.status)
+                return
             # Show cache stats in a nicely readable way.
             # NEW 19.06.2021: Qlever uses new keys for cachestats (else).
-            cache_stats = eval(cache_stats_response.data.decode("utf-8"))
+            #
+            # NEW: The cache stats are JSON, so we parse them as such. This
+            # used to be an eval of the response, which would have executed
+            # whatever the backend (or anyone in between) sent us.
+            cache_stats = json_loads(cache_stats_response.data)
             if "num-cached-elements" in cache_stats:
                 num_results = cache_stats["num-cached-elements"]
                 size_results_mb = cache_stats["cached-size"] / 1e9
@@ -747,14 +1879,15 @@ class Backend:
                 num_pinned = cache_stats["num-pinned-entries"]
                 size_pinned_mb = cache_stats["pinned-size"] / 1e9
             log.info("%s %d unpinned cached results in %.1f GB"
-                     " + %d pinned results in %.1f GB"
-                     % (self.log_prefix, num_results, size_results_mb,
-                         num_pinned, size_pinned_mb))
+                     " + %d pinned results in %.1f GB",
+                     self.log_prefix, num_results, size_results_mb,
+                     num_pinned, size_pinned_mb)
         except Exception as e:
-            error_msg = "%s Error getting cache statistics from %s:%d (%s)" \
-                    % (self.log_prefix, self.host, self.port, str(e))
-            log.info(error_msg)
-            return Response(query_path=query_path, error_msg=error_msg)
+            # NOTE: This used to return an error Response, with an undefined
+            # query_path. The resulting NameError made Backend.query report an
+            # error for a query that was actually fine.
+            log.info("%s Error getting cache statistics from %s:%d (%s)",
+                     self.log_prefix, self.host, self.port, str(e))
 
 
 class QueryProcessor:
@@ -767,18 +1900,217 @@ class QueryProcessor:
     """
 
     def __init__(self,
-            backend_1, backend_2, timeout_normal, qlever_name_service):
+            backend_1, backend_2, timeout_normal, qlever_name_service,
+            response_cache=None):
         """
         Create the two backends using the class above. Also create a
         QleverNameService in case we need it (costs nothing to create, just
         copies the arguments to the class, see above).
+
+        If response_cache is not None, it is an LruCache for the responses to
+        SPARQL queries, see query.
         """
         self.backend_1 = backend_1
         self.backend_2 = backend_2
         self.timeout_normal = timeout_normal
         self.qlever_name_service = qlever_name_service
+        # Thread pool for querying the two backends in parallel, see
+        # query_backends_in_parallel. Since the QueryProcessor is shared by all
+        # requests, we need one thread for each request handled in parallel
+        # (the query to backend 1 is done by the thread handling the request).
+        # The threads of each pool in this script have a name prefix, so that
+        # one can tell them apart in a debugger or in py-spy dump.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=backend_2.max_pool_size,
+                thread_name_prefix="backends")
+        # Are the two backends the same (see query_backends_in_parallel)?
+        self.backends_are_same = \
+                (backend_1.host, backend_1.port, backend_1.base_path) == \
+                (backend_2.host, backend_2.port, backend_2.base_path)
+        self.response_cache = response_cache
+        # Larger responses are not cached, so that a few huge results cannot
+        # take up all the memory.
+        self.response_cache_max_entry_size = 10 * 1000 * 1000
+        # Queries that are currently processed and whose response will be
+        # cached, with an event that is set when that is done, see query.
+        self.inflight_queries = {}
+        self.inflight_queries_lock = threading.Lock()
+
+    def query(self, path, headers, bypass_cache=False):
+        """
+        Process the query (see process_query below), unless we have a cached
+        response for it. The cache key is the path as received by the proxy
+        (so that a cache hit also saves the work of the name service), with
+        the SPARQL query normalized (see response_cache_key below), and the
+        Accept header (which determines the format of the result). Only SPARQL
+        queries with a proper response are cached.
+
+        If bypass_cache=True (the caller sent Cache-Control: no-cache, see
+        process_request), do not use a cached response, but always ask the
+        backend. The fresh response replaces the one in the cache.
+        """
+        # If the backend is asked to clear its cache, our cached responses and
+        # the cached probe results of the name service may no longer be valid
+        # either (for example, because the backend now has different data).
+        if path.startswith("/?cmd=clear-cache"):
+            if self.response_cache != None:
+                num_entries = self.response_cache.clear()
+                log.info("Cleared response cache with %d entries", num_entries)
+            if self.qlever_name_service:
+                self.qlever_name_service.clear_probe_cache()
+
+        # The SPARQL query is unquoted only once per request, here for the
+        # cache key and then passed on to process_query.
+        is_cacheable = self.response_cache != None \
+                and path.startswith("/?query=")
+        query_parts = None
+        if is_cacheable:
+            query_parts = split_query_path(path)
+            cache_key = self.response_cache_key(*query_parts, headers)
+            cached_http_response = self.response_cache.get(cache_key) \
+                    if not bypass_cache else None
+            if cached_http_response != None:
+                log.info("\x1b[1mResponse found in cache\x1b[0m")
+                return Response(http_response=cached_http_response)
+
+        # NEW: If the same query is currently processed for another request
+        # (typically, many users load the same page at the same time), we do
+        # not send it to the backend again, but wait until that is done and
+        # then take the response from the cache. If it is not there after
+        # that (for example, because the query failed or the result was too
+        # large), or if it takes too long, we process the query ourselves.
+        is_inflight_owner = False
+        if is_cacheable and not bypass_cache:
+            with self.inflight_queries_lock:
+                inflight_event = self.inflight_queries.get(cache_key)
+                if inflight_event == None:
+                    self.inflight_queries[cache_key] = threading.Event()
+                    is_inflight_owner = True
+            if not is_inflight_owner:
+                log.info("Same query is already being processed, waiting")
+                if not inflight_event.wait(self.timeout_normal):
+                    # Make sure that a request that never finished (for
+                    # example, because of an error in the request handler)
+                    # does not keep the others waiting forever.
+                    with self.inflight_queries_lock:
+                        if self.inflight_queries.get(cache_key) \
+                                is inflight_event:
+                            del self.inflight_queries[cache_key]
+                cached_http_response = self.response_cache.get(cache_key)
+                if cached_http_response != None:
+                    log.info("\x1b[1mResponse found in cache\x1b[0m")
+                    return Response(http_response=cached_http_response)
+
+        # NOTE: A response with an error status but without QLever's error
+        # JSON (for example, an HTML page from a web server in front of the
+        # backend) still has an http_response, so we check the status, too.
+        #
+        # NOTE: We only cache responses from Backend 1. A response from
+        # Backend 2 is the fallback for a YAML with two queries (see
+        # query_backends_in_parallel), the result of the simplified query 2.
+        # If we cached that, Backend 1 would not get another chance for the
+        # whole TTL, although it is typically fast on the next try (when its
+        # own cache is warm).
+        try:
+            response = self.process_query(path, headers, query_parts)
+        except:
+            if is_inflight_owner:
+                self.finish_inflight_query(cache_key)
+            raise
+        if is_cacheable and response.http_response != None \
+                and response.http_response.status == 200 \
+                and response.backend_id == 1:
+            http_response = response.http_response
+            # For a streamed response, we can only cache it after all the
+            # data has been sent to the caller.
+            #
+            # NOTE: Unless the backend already told us that the data is too
+            # large. Then the requests waiting for this query can go ahead
+            # right away (below), and do not have to wait until all the data
+            # has been streamed. If the data is compressed, we only know that
+            # when streaming it, see Response.stream_data.
+            content_length = response.content_length()
+            if content_length != None \
+                    and content_length > self.response_cache_max_entry_size:
+                log.info("Response too large for the cache (%d bytes)",
+                         content_length)
+            elif response.is_streamed:
+                response.on_complete = lambda data: self.response_cache.put(
+                        cache_key, CachedHTTPResponse(http_response, data),
+                        len(data))
+                response.on_complete_max_size = \
+                        self.response_cache_max_entry_size
+                if is_inflight_owner:
+                    response.on_release = \
+                            lambda: self.finish_inflight_query(cache_key)
+                    is_inflight_owner = False
+            else:
+                self.response_cache.put(cache_key,
+                        CachedHTTPResponse(http_response),
+                        len(http_response.data))
+        if is_inflight_owner:
+            self.finish_inflight_query(cache_key)
+        return response
 
-    def query(self, path, headers):
+    def finish_inflight_query(self, cache_key):
+        """
+        Processing of the query with the given cache key is done (and its
+        response is in the cache, if it can be cached), see query. Wake up all
+        the requests waiting for it.
+        """
+        with self.inflight_queries_lock:
+            inflight_event = self.inflight_queries.pop(cache_key, None)
+        if inflight_event != None:
+            inflight_event.set()
+
+    def response_cache_key(self, sparql_query, other_parameters, headers):
+        """
+        Cache key for the response to a SPARQL query, given as returned by
+        split_query_path. Unless the query contains string literals (or is a
+        YAML with two queries), its whitespace is normalized, so that the same
+        query with a different layout (or with + instead of %20) gives the same
+        key. Also, comments are removed and the PREFIX declarations are sorted.
+        The other URL parameters and the Accept header are taken as they are.
+        The query sent to the backend is not changed by any of this.
+
+        >>> qp = QueryProcessor.__new__(QueryProcessor)
+        >>> key = lambda path: qp.response_cache_key(*split_query_path(path), {})
+        >>> key("/?query=SELECT+%3Fx%0A+WHERE+{}") == \\
+        ...   key("/?query=SELECT%20%3Fx%20WHERE%20{}%20")
+        True
+        >>> key("/?query=SELECT+%3Fx&name_service=true") == \\
+        ...   key("/?query=SELECT+%3Fx")
+        False
+        >>> key("/?query=SELECT+%22a++b%22") == key("/?query=SELECT+%22a+b%22")
+        False
+        >>> key("/?query=PREFIX+a:+<a%23>+PREFIX+b:+<b>+SELECT+*+{}") == \\
+        ...   key("/?query=PREFIX+b:+<b>%0A%23+Comment%0APREFIX+a:+<a%23>+SELECT+*+{}")
+        True
+        """
+        # NOTE: Whitespace inside a string literal matters ("a  b" and "a b"
+        # are different queries), and so does the indentation of a YAML, so
+        # only normalize if there is neither. The same for comments (a # can
+        # also occur inside a string literal).
+        if "\"" not in sparql_query and "'" not in sparql_query \
+                and not sparql_query.startswith("yaml"):
+            if "#" in sparql_query:
+                sparql_query = RE_SPARQL_COMMENT.sub("", sparql_query)
+            sparql_query = " ".join(sparql_query.split())
+            # The order of the PREFIX declarations does not matter, unless the
+            # same prefix is declared twice (then the last one counts).
+            match = RE_PREFIX_DECLARATIONS.match(sparql_query + " ")
+            if match:
+                prefixes = match.group(0).rstrip().split(" PREFIX ")
+                prefixes[0] = prefixes[0][len("PREFIX "):]
+                names = set(prefix.split(" ", 1)[0] for prefix in prefixes)
+                if len(names) == len(prefixes):
+                    sparql_query = " ".join(
+                        ["PREFIX " + prefix for prefix in sorted(prefixes)]
+                        + [sparql_query[match.end():]])
+        return make_cache_key(sparql_query, other_parameters,
+                              headers.get("Accept"))
+
+    def process_query(self, path, headers, query_parts=None):
         """
         Decide what to do depending on the form of the query:
 
@@ -787,29 +2119,62 @@ class QueryProcessor:
 
         2. Otherwise send the query to backend 1, with timeout_normal
         """
+        # NOTE: We look at the path only once to see what kind of request it
+        # is, and then dispatch on that. We deliberately do not parse the
+        # whole query string (with urllib.parse.parse_qsl or the like): that
+        # would unquote all the parameters, which we would then have to quote
+        # again for the backend. Only the value of the query parameter is
+        # unquoted, and only once (see query above).
+        is_sparql_query = path.startswith("/?query=")
+        is_yaml = is_sparql_query and path.startswith("yaml", len("/?query="))
+
         # CASE 1: a YAML containing information about two SPARQL queries, one
         # for each backend.
-        if path.startswith("/?query=yaml"):
+        if is_yaml:
+            queries_yaml = None
             try:
                 log.info("YAML with two queries, trying to parse it")
-                queries_yaml = urllib.parse.unquote(re.sub("^/\?query=", "", path))
-                queries_yaml = re.sub("\n(LIMIT)", "\n  footer: |-\n\\1", queries_yaml)
-                queries_yaml = re.sub("\n(PREFIX|LIMIT|OFFSET)", "\n    \\1", queries_yaml)
-                log.debug("YAML = \n" + queries_yaml)
-                queries = yaml.safe_load(queries_yaml)["yaml"]
-                log.debug("QUERIES = " + str(queries))
+                # NOTE: We know that the path starts with /?query=, so no
+                # need for a regex to remove that.
+                #
+                # NOTE: This is the only place left where we unquote a query
+                # that was unquoted before (for the cache key, see query). We
+                # cannot simply take that one: it was unquoted with
+                # unquote_plus and ends at the first &, while the YAML has
+                # always been unquoted as a whole and with a + staying a +.
+                queries_yaml = urllib.parse.unquote(path[len("/?query="):])
+                # NEW: Start the footer and indent in one pass (this used to
+                # be two substitutions, one for the footer and one for the
+                # indentation, with the same result).
+                queries_yaml = RE_YAML_INDENT.sub(
+                        lambda match: YAML_INDENT_REPLACEMENTS[match.group(1)],
+                        queries_yaml)
+                log.debug("YAML = \n%s", queries_yaml)
+                # NEW: The YAML has a simple fixed form, which we parse
+                # ourselves, see parse_yaml_queries. Only if that fails (and
+                # the YAML is probably broken anyway), use the YAML parser.
+                queries = parse_yaml_queries(queries_yaml)
+                if queries == None:
+                    queries = yaml.load(queries_yaml, Loader=YamlLoader)["yaml"]
+                log.debug("QUERIES = %s", queries)
                 query_1 = queries["query_1"] + "\n" + queries["footer"]
                 query_2 = queries["query_2"] + "\n" + queries["footer"]
-                log.info("Query 1: " + abbrev(query_1, compact_ws=True))
-                log.info("Query 2: " + abbrev(query_2, compact_ws=True))
-                path_1 = "/?query=" + urllib.parse.quote(query_1)
-                path_2 = "/?query=" + urllib.parse.quote(query_2)
-                return self.query_backends_in_parallel(path_1, path_2, headers)
+                # NOTE: The whitespace of each query is compacted only once,
+                # and only for the part that is shown, see abbrev.
+                if log.isEnabledFor(logging.INFO):
+                    log.info("Query 1: %s", abbrev(query_1, compact_ws=True))
+                    log.info("Query 2: %s", abbrev(query_2, compact_ws=True))
+                # NEW: The two queries are no longer quoted for the URL of a
+                # GET request, see query_backends_in_parallel.
+                return self.query_backends_in_parallel(
+                        query_1, query_2, headers)
             except Exception as e:
                 error_msg = "\x1b[31mError parsing the YAML string (%s)\x1b[0m" % str(e)
                 log.info(error_msg)
-                log.info("YAML = \n" + queries_yaml)
-                return Response(query_path=path, error_msg=error_msg)
+                if queries_yaml != None:
+                    log.info("YAML = \n%s", queries_yaml)
+                return Response(query_path=path, error_msg=error_msg,
+                                status_code=400)
         # CASE 2: An ordinary query, which we send to backend 1. This can be a
         # SPARQL query or a command like /?cmd=stats or /?cmd=clear-cache
         else:
@@ -823,69 +2188,155 @@ class QueryProcessor:
             # other situations (e.g. for SPARQL Autocompletion queries).
             # Previously, this script either used the name service for all
             # queries or for none, which did not make too much sense.
-            if path.startswith("/?query="):
-                # Note that parse_qsl creates a list of key-value pairs and also
-                # automatically unquotes (and urlencode quotes again).
-                parameters = urllib.parse.parse_qsl(path[2:])
-                sparql_query = parameters[0][1]
+            if is_sparql_query:
+                # The value of the query parameter is everything up to the
+                # next &. We only unquote that value (and not the other
+                # parameters), and only when we need it, that is, for the log
+                # or for the name service (and only if the caller has not
+                # done it already, see query). Otherwise, the path is
+                # forwarded as is.
+                use_name_service = self.qlever_name_service \
+                    and "&name_service=true" in path
+                if query_parts == None and (use_name_service
+                                            or log.isEnabledFor(logging.INFO)):
+                    query_parts = split_query_path(path)
+                if query_parts != None:
+                    sparql_query, other_parameters = query_parts
                 # NEW 14.04.2022: Show the SPARQL query in the log (no matter
                 # whether we want the name service or not, it's just good to be
                 # able to have the full SPARQL query in the log in a manner that
                 # we can just copy & paste).
-                log.info("Found URL parameter \"query\" with this value: "
-                         "\n\x1b[90m%s\x1b[0m" % re.sub("\s+$", "", sparql_query))
+                if log.isEnabledFor(logging.INFO):
+                    log.info("Found URL parameter \"query\" with this value: "
+                             "\n\x1b[90m%s\x1b[0m", sparql_query.rstrip())
                 # Now comes the name-service specfic code. 
-                if self.qlever_name_service \
-                    and "&name_service=true" in path:
+                if use_name_service:
                   # Remove the name_service key and value, we only needed it to
-                  # determine whether we should activate the name service.
-                  parameters.remove(("name_service", "true"))
+                  # determine whether we should activate the name service. The
+                  # other parameters are kept as they are (still quoted).
+                  other_parameters = other_parameters.replace(
+                          "&name_service=true", "", 1)
                   # log.info("SPARQL query before enhancing:\n%s" % sparql_query)
                   new_sparql_query = \
                           self.qlever_name_service.enhance_query(sparql_query, headers)
-                  parameters[0] = ("query", new_sparql_query)
-                  path = "/?" + urllib.parse.urlencode(parameters)
+                  # NEW: The enhanced query is sent in the body of a POST
+                  # request, so that we do not have to quote it (and the other
+                  # parameters stay in the URL), see Backend.query.
+                  return self.backend_1.query("/?" + other_parameters, headers,
+                          self.timeout_normal, sparql_query=new_sparql_query,
+                          stream=True)
                 else:
                   log.info("SPARQL query without name service, processed using Backend 1")
             else:
                 log.info("Non-SPARQL query, processed using Backend 1")
-            return backend_1.query(path, headers, self.timeout_normal)
+            #
+            # NEW: The result of an ordinary query can be large, so we do not
+            # read it here but stream it to the caller, see do_GET.
+            return self.backend_1.query(path, headers, self.timeout_normal,
+                    stream=True)
 
 
-    def query_backends_in_parallel(self, path_1, path_2, headers):
+    def query_backends_in_parallel(self, query_1, query_2, headers):
         """
         Query both backends in parallel with a preference for a result from the
-        first backend, as explained above.
-        """
-
-        # Send two concurrent requests to the two backends. Each of them will
-        # append their response object to the given queue.
-        result_queue = queue.Queue()
-        thread_1 = threading.Thread(
-                target=self.backend_1.query_and_write_to_queue,
-                args=(path_1, headers, self.backend_1.timeout_seconds, result_queue))
-        thread_2 = threading.Thread(
-                target=self.backend_2.query_and_write_to_queue,
-                args=(path_2, headers, self.backend_2.timeout_seconds, result_queue))
-        for thread in [thread_1, thread_2]:
-            thread.daemon = True
-            thread.start()
-         
-        # Wait until the first of the two backends has responded (note that
-        # queue.get is blocking). Then there are three cases:
-        # 1. Backend 1 first, with response -> perfect
-        # 2. Backend 1 first, no response -> wait for Backend 2
-        # 3. Backend 2 first -> wait for Backend 1 and prefer if response
-        response, backend_id = result_queue.get()
-        if backend_id == 1 and response.http_response == None:
-            backend_1_error_data = response.error_data
-            response, backend_id = result_queue.get()
-        elif backend_id == 2:
-            log.info("Backend 2 responded first -> give Backend 1 a chance, too")
-            response_2, backend_id_2 = result_queue.get()
-            backend_1_error_data = response_2.error_data
-            if response_2.http_response != None:
-                response, backend_id = response_2, backend_id_2
+        first backend, as explained above. The two SPARQL queries are sent as
+        they are, in the body of a POST request, see Backend.query.
+
+        If both backends are actually the same, we do not ask the two queries
+        in parallel, but first query 1 and then, only if that fails, query 2.
+        Asking both in parallel would only put additional load on that
+        backend (which then slows down query 1 as well).
+
+        The same if the two queries are the same (for example, a YAML with the
+        same query twice): then backend 2 is only asked if backend 1 fails.
+        This can take longer in that case, but in the normal case (backend 1
+        answers in time), it saves a whole query on backend 2.
+
+        NOTE: In both cases, the fallback takes longer than with parallel
+        queries: if query 1 times out, the response comes after up to the
+        timeout of backend 1 plus that of backend 2 (and not after the timeout
+        of backend 2). See the README.
+
+        No thread is created here: the query to backend 2 goes to the thread
+        pool of the QueryProcessor (created once), and the one to backend 1 is
+        done by the calling thread. See BoundedThreadingHTTPServer for why we
+        use threads and not asyncio.
+        """
+
+        if self.backends_are_same or query_1 == query_2:
+            log.info("%s -> ask query 2 only if query 1 fails",
+                     "Backends 1 and 2 are the same" if self.backends_are_same
+                         else "Queries 1 and 2 are the same")
+            # NOTE: The response from backend 1 is not streamed, see below.
+            response_1 = self.backend_1.query(
+                    "/?", headers, self.backend_1.timeout_seconds,
+                    sparql_query=query_1, stream=False)
+            # NOTE: We only need to know whether Backend 1 sent an error
+            # JSON (for the log message below), not the error JSON itself.
+            # Response.error_data builds that JSON (for an error of the proxy,
+            # like a timeout) on each call, so we do not call it here.
+            backend_1_sent_error = response_1.backend_error_data != None
+            if response_1.http_response != None:
+                response, backend_id = response_1, 1
+            else:
+                response = self.backend_2.query(
+                        "/?", headers, self.backend_2.timeout_seconds,
+                        sparql_query=query_2, stream=True)
+                backend_id = 2
+        else:
+            # Send two concurrent requests to the two backends. The request to
+            # backend 2 goes to the thread pool from the constructor, the
+            # request to backend 1 is done right here, in the thread handling
+            # this request.
+            #
+            # NEW: Previously, both requests went to the thread pool and this
+            # thread just waited for them. But we need the response from
+            # backend 1 in any case (it is preferred whenever there is one),
+            # so this thread might as well do that request itself, which saves
+            # one thread (and the handing over of the request and response
+            # between threads) per query.
+            #
+            # NEW: Like for an ordinary query, the data of the response from
+            # backend 2 is streamed to the caller (see process_query). The
+            # query call returns as soon as the headers of the response are
+            # there, which for QLever is when the result has been computed.
+            #
+            # NOTE: But not the response from backend 1. Its timeout (0.5
+            # seconds in the README) is also the read timeout of the pool, so
+            # a slow read in the middle of a streamed result would give the
+            # caller a truncated result, with no fallback to backend 2 (the
+            # headers have been sent by then). Reading the data here means
+            # that a read timeout is just a failed query 1, and backend 2
+            # takes over. The results for these YAML queries are small, so
+            # holding them in memory is fine.
+            future_2 = self.executor.submit(self.backend_2.query,
+                    "/?", headers, self.backend_2.timeout_seconds,
+                    sparql_query=query_2, stream=True)
+            response_1 = self.backend_1.query(
+                    "/?", headers, self.backend_1.timeout_seconds,
+                    sparql_query=query_1, stream=False)
+
+            # Now there are three cases:
+            # 1. Backend 1 first, with response -> perfect
+            # 2. Backend 1 first, no response -> wait for Backend 2
+            # 3. Backend 2 first -> we gave Backend 1 a chance anyway, and
+            #    prefer its response if there is one
+            if future_2.done():
+                log.info("Backend 2 responded first -> gave Backend 1 a chance, too")
+            backend_1_sent_error = response_1.backend_error_data != None
+            if response_1.http_response != None:
+                response, backend_id = response_1, 1
+                # We do not need the result from Backend 2 anymore. If its
+                # query has not even started yet (all threads of the pool
+                # busy), this makes sure that it never does. A running query
+                # cannot be cancelled, it just runs until its timeout, and
+                # then we throw away its response (which also gives the
+                # connection back to the pool).
+                if not future_2.cancel():
+                    future_2.add_done_callback(
+                            lambda future: future.result().discard())
+            else:
+                response, backend_id = future_2.result(), 2
 
         # We now have three cases:
         # 1. We have a response from  backend 1 (best case)
@@ -894,11 +2345,10 @@ class QueryProcessor:
         if response.http_response != None and backend_id == 1:
             log.info("BEST CASE: Backend 1 responded in time")
         elif response.http_response != None and backend_id == 2:
-            log.info("FALLBACK: Backend 1 " +
-                     ("responsed with an error"
-                         if backend_1_error_data != None
-                         else "did not not respond in time") + 
-                     ", taking result from Backend 2")
+            log.info("FALLBACK: Backend 1 %s, taking result from Backend 2",
+                     "responsed with an error"
+                         if backend_1_sent_error
+                         else "did not not respond in time")
         else:
             log.info("WORST CASE: Neither backend responded in time :-(")
 
@@ -907,7 +2357,8 @@ class QueryProcessor:
 
 
 def MakeRequestHandler(
-        backend_1, backend_2, timeout_normal, qlever_name_service):
+        backend_1, backend_2, timeout_normal, qlever_name_service,
+        response_cache=None):
     """
     Returns a RequestHandler class for handling GET requests to the proxy for
     using the given backends.
@@ -919,22 +2370,43 @@ def MakeRequestHandler(
     backends global, which would be an ugly solution).
     """
 
+    # The QueryProcessor does not depend on the request, so we create it only
+    # once here and not for every request (an object of the RequestHandler
+    # class is created for every request).
+    #
+    # NOTE: The names must differ from those of the class attributes below,
+    # otherwise the class body would look them up in the global scope.
+    shared_backend_1 = backend_1
+    shared_backend_2 = backend_2
+    shared_query_processor = QueryProcessor(
+            backend_1, backend_2, timeout_normal, qlever_name_service,
+            response_cache)
+
     class RequestHandler(http.server.BaseHTTPRequestHandler):
         """
         Class for handling GET requests to the proxy.
         
+        NOTE: The members are class attributes, so that they are shared by all
+        requests (BaseHTTPRequestHandler.__init__ already handles the request,
+        so there is no point in overriding __init__).
         """
-    
-        def __init__(self, *args, **kwargs):
-            """
-            NOTE: The call to super().__init__ must come at the end because
-            (confusingly) do_GET is called during BaseHTTPRequestHandler.__init__
-            """
-            self.backend_1 = backend_1
-            self.backend_2 = backend_2
-            self.query_processor = QueryProcessor(
-                    backend_1, backend_2, timeout_normal, qlever_name_service)
-            super(RequestHandler, self).__init__(*args, **kwargs)
+
+        backend_1 = shared_backend_1
+        backend_2 = shared_backend_2
+        query_processor = shared_query_processor
+
+        # The headers and the data of a response are written with separate
+        # send calls. With Nagle's algorithm, the second one can wait for the
+        # ACK of the first one (which the caller may delay by up to 40ms), so
+        # we switch it off (this sets TCP_NODELAY on the socket).
+        #
+        # NOTE: The headers are already written with a single send call
+        # (send_header only appends to a buffer, which end_headers flushes),
+        # so there is no need for a buffered self.wfile. I also left SO_SNDBUF
+        # alone: setting it explicitly switches off the autotuning of the send
+        # buffer by Linux, which goes up to 4 MB by default, more than what we
+        # would set it to.
+        disable_nagle_algorithm = True
      
         def log_message(self, format_string, *args):
             """
@@ -949,73 +2421,138 @@ def MakeRequestHandler(
             
             NEW: The processing of the query happens in the thread, in order to
             allow concurreny (otherwise one slow query can block the whole
-            proxy, as was the case in a previous version).
+            proxy, as was the case in a previous version). The thread is one of
+            the worker threads of BoundedThreadingHTTPServer, no thread is
+            created per request.
             """
 
             # Process request.
             path = str(self.path)
-            # headers = re.sub("\n", " | ", str(self.headers))
+            # NOTE: Turning all the headers into a string is only worth it when
+            # we actually log them. For a fixed string, str.replace is enough,
+            # no need for re.sub.
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Headers: %s",
+                          str(self.headers).strip().replace("\n", " | "))
             # path_unquoted = urllib.parse.unquote(path)
             # log.info("")
-            print()
+            # NOTE: The empty line separates the log messages of the requests,
+            # so we only need it when there are any.
+            if log.isEnabledFor(logging.INFO):
+                print()
             self.process_request(path, self.headers)
-            # This did not work.
-            # thread = threading.Thread(
-            #         target=RequestHandler.process_request,
-            #         args=(self, path, headers))
-            # thread.start()
 
 
         def process_request(self, path, headers):
             """
             Process the request and measure the total time.
             
-            NOTE: This is called from do_GET and is run in a separate thread for
-            each request, see do_GET above.
-
-            TODO: It seems that "headers" is currently not used in this function
-            and neither was it in the previous (unthreaded) version of the code.
+            NOTE: This is called from do_GET and is run in a worker thread, see
+            do_GET above. From the headers, we only use Accept (which is passed
+            on to the backend), Accept-Encoding, and Cache-Control.
             """ 
 
-            start_time = time.time()
-            log.info("GET request received [unquoted and whitespace compressed]:\n\x1b[90m%s\x1b[0m"
-                    % abbrev(path, unquote=True, compact_ws=True))
+            # NOTE: We measure with a monotonic clock and in integer
+            # nanoseconds, time.time() jumps when the system clock is adjusted.
+            start_time = time.monotonic_ns()
+            if log.isEnabledFor(logging.INFO):
+                log.info("GET request received [unquoted and whitespace compressed]:"
+                         "\n\x1b[90m%s\x1b[0m",
+                         abbrev(path, unquote=True, compact_ws=True))
             # log.info("GET request received [unquoted and newline inserted]:"
             #          " \x1b[90m%s\x1b[0m"
             #         % re.sub("^(/\?query=)", "\\1\n",
             #             abbrev(path, unquote=True, compact_ws=False)))
 
-            # Not sure which kind of object "headers" is, but str(headers) turns
-            # it into a newline-separated list, so we simply extract the
-            # "Accept" header from that list and turn it into a dictionary. Not
-            # pretty, but it works.
-            match = re.search("Accept: (\S+)", str(headers))
-            if match != None:
-                headers = { "Accept": match.group(1) }
+            accept_encoding = headers.get("Accept-Encoding", "")
+            # NEW: With Cache-Control: no-cache, the caller asks for a fresh
+            # result (for example, after the data of the backend changed),
+            # see QueryProcessor.query.
+            bypass_cache = "no-cache" in headers.get("Cache-Control", "")
+
+            # The only header we pass on to the backend is "Accept". As before
+            # (when we searched for it in str(headers) with a regex), we take
+            # its value only up to the first whitespace.
+            #
+            # NEW: "headers" is a http.client.HTTPMessage, so we can just ask
+            # it for the header, instead of turning all the headers into a
+            # string for every request.
+            accept = headers.get("Accept")
+            if accept != None and accept.split():
+                headers = { "Accept": accept.split(None, 1)[0] }
             else:
                 headers = {}
-            log.info("Headers: %s" % headers)
+            log.info("Headers: %s", headers)
     
             # Process query. The query process will decided whether to ask both
             # backends in parallel, whether to call the QLever Name Service,
             # etc. If something goes wrong, the response is None.
-            response = self.query_processor.query(path, headers)
+            response = self.query_processor.query(path, headers, bypass_cache)
 
             # For both case below, the QLever UI will only accept the response
             # when there is a Access-Control-Allow-Origin header.
             #
             # If we have a HTTPResponse, forward to caller, including selected headers.
+            #
+            # NEW: The status code of the backend is passed on, too (before, it
+            # was always 200, also for example for an error page from a web
+            # server in front of the backend).
             if response.http_response != None:
-                self.send_response(200)
-                headers_preserved = ["Content-Type", "Access-Control-Allow-Origin"]
-                for header_key in headers_preserved:
-                    header_value = response.http_response.getheader(header_key)
-                    if header_value != None:
-                        self.send_header(header_key, header_value)
-                self.end_headers()
-                self.wfile.write(response.http_response.data)
-                log.debug("Forwarded result to caller"
-                          " (headers preserved: %s)" % ", ".join(headers_preserved))
+                # NEW: If writing the headers fails (typically, because the
+                # caller has closed the connection already, as autocompletion
+                # clients do all the time), stream_data below never starts.
+                # Then we have to give the connection to the backend back
+                # ourselves, and wake up the identical requests waiting for
+                # this one (both is done by discard, via on_release).
+                try:
+                    self.send_response(response.http_response.status)
+                    response_headers = response.http_response.headers
+                    for header_key in HEADERS_PRESERVED:
+                        header_value = response_headers.get(header_key)
+                        if header_value != None:
+                            self.send_header(header_key, header_value)
+                    # NEW: If the backend sent gzip'ed data (we always ask
+                    # for it, see Backend) and the caller accepts that, too,
+                    # pass the data on as it is. That saves bandwidth to the
+                    # caller and decompressing it here. Otherwise, urllib3
+                    # decompresses it.
+                    decode_content = not (response.is_gzipped()
+                                          and accepts_gzip(accept_encoding))
+                    if not decode_content:
+                        self.send_header("Content-Encoding", "gzip")
+                    # Since the data depends on Accept-Encoding, we have to
+                    # say so. Otherwise, an HTTP cache between us and the
+                    # caller could give the gzip'ed data to a caller that did
+                    # not ask for it. We send it for every forwarded response
+                    # (also if not gzip'ed), so that the cache knows in any
+                    # case.
+                    self.send_header("Vary", "Accept-Encoding")
+                    # NEW: Also send the length of the data if we know it, so
+                    # that the caller knows how much is still coming, see
+                    # Response.content_length.
+                    content_length = response.content_length(decode_content)
+                    if content_length != None:
+                        self.send_header("Content-Length",
+                                         str(content_length))
+                    self.end_headers()
+                except Exception as e:
+                    response.discard()
+                    log.error("\x1b[31mError sending headers to caller (%s)"
+                              "\x1b[0m", e)
+                    return
+                # If the response is streamed, the data is forwarded chunk by
+                # chunk as it comes from the backend. If something goes wrong
+                # in between, we cannot send an error response anymore (the
+                # headers are already sent), so we can only log it.
+                try:
+                    for chunk in response.stream_data(
+                            decode_content=decode_content):
+                        self.wfile.write(chunk)
+                except Exception as e:
+                    log.error("\x1b[31mError forwarding result to caller (%s)"
+                              "\x1b[0m", e)
+                log.debug("Forwarded result to caller (headers preserved: %s)",
+                          HEADERS_PRESERVED)
             # Otherwise, send an error message
             else:
                 self.send_response(response.error_status_code)
@@ -1025,17 +2562,128 @@ def MakeRequestHandler(
                 self.wfile.write(response.error_data)
                 log.info("\x1b[31mSending QLever error JSON to caller\x1b[0m")
 
-            end_time = time.time()
+            end_time = time.monotonic_ns()
             log.info("\x1b[1mTotal time spend on request: %dms\x1b[0m",
-                     int(1000 * (end_time - start_time)))
+                     (end_time - start_time) // 1000000)
 
 
     # Don't forget to return the class :-)
     return RequestHandler
 
 
+class BoundedThreadingHTTPServer(http.server.ThreadingHTTPServer):
+    """
+    Like ThreadingHTTPServer, but the requests are handled by a fixed number of
+    worker threads instead of a new thread per request. This way, a spike of
+    requests cannot create an arbitrary number of threads (which would then
+    all compete for the connections to the backends anyway).
+
+    NOTE: An event loop (asyncio with aiohttp for the server and the backends)
+    would need fewer threads. But the proxy spends almost all its time waiting
+    for the backends, the number of requests handled in parallel is small, and
+    the threads from the pools are reused. So the threads cost next to
+    nothing, and we can keep the simple blocking code with http.server and
+    urllib3. For the same reason, a faster event loop (like uvloop) would not
+    buy us anything: the only loop here is the one of serve_forever, which
+    just waits for new connections and hands them to the workers.
+
+    NOTE: The same goes for HTTP/2 to the backends (with httpx): multiplexing
+    would let us ask many queries over a single connection, but the pools of
+    the backends already keep one open connection per worker (see Backend),
+    so there is no handshake to save. And QLever itself speaks HTTP/1.1.
+    """
+
+    # The backlog of the listening socket. The default of socketserver is 5,
+    # so with a burst of requests (for example, from SPARQL autocompletion)
+    # new connections are refused or delayed while all workers are busy.
+    request_queue_size = 128
+
+    def __init__(self, server_address, request_handler_class, max_workers,
+            max_queued=0, reuse_port=False):
+        """
+        If max_queued > 0, at most that many requests wait for a free worker,
+        further requests are rejected right away, see process_request.
+
+        If reuse_port=True, set SO_REUSEPORT on the listening socket, so that
+        several instances of the proxy can listen on the same port (the kernel
+        then distributes the connections among them).
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="request")
+        self.max_requests = max_workers + max_queued if max_queued > 0 else 0
+        self.num_requests = 0
+        self.num_requests_lock = threading.Lock()
+        self.reuse_port = reuse_port
+        # The response for a rejected request (see reject_request) is always
+        # the same, so we build it only once here. Under overload, the
+        # rejections are what the main thread spends its time on.
+        error_data = Response(query_path="",
+                error_msg="too many requests, try again later").error_data
+        self.reject_response = \
+                b"HTTP/1.0 503 Service Unavailable\r\n" \
+                b"Content-Type: application/json\r\n" \
+                b"Access-Control-Allow-Origin: *\r\n" \
+                b"Retry-After: 1\r\n" \
+                b"Content-Length: %d\r\n\r\n" % len(error_data) + error_data
+        super().__init__(server_address, request_handler_class)
+
+    def server_bind(self):
+        # NOTE: Newer versions of socketserver have allow_reuse_port for this,
+        # but not the older ones, so we do it ourselves.
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        """
+        Handle the request in one of the worker threads. The method
+        process_request_thread is from ThreadingMixIn, it handles the request
+        and closes the connection in the end.
+
+        NEW: If there are already too many requests waiting for a worker,
+        reply with 503 Service Unavailable right away. Otherwise, under
+        overload, the waiting requests would pile up and each would be
+        answered only when the caller has long given up on it.
+        """
+        with self.num_requests_lock:
+            is_overloaded = self.max_requests > 0 \
+                    and self.num_requests >= self.max_requests
+            if not is_overloaded:
+                self.num_requests += 1
+        if is_overloaded:
+            log.info("\x1b[31mToo many requests (%d), rejecting request from"
+                     " %s\x1b[0m", self.num_requests, client_address[0])
+            self.reject_request(request)
+            return
+        self.executor.submit(self.process_request_and_count,
+                request, client_address)
+
+    def process_request_and_count(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            with self.num_requests_lock:
+                self.num_requests -= 1
+
+    def reject_request(self, request):
+        """
+        Send a 503 response with the usual error JSON and close the connection
+        (without reading the request, that would need a worker).
+        """
+        try:
+            request.sendall(self.reject_response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
 def server_loop(hostname, port,
-        backend_1, backend_2, timeout_normal, qlever_name_service):
+        backend_1, backend_2, timeout_normal, qlever_name_service,
+        max_workers, response_cache=None, max_queued=0, reuse_port=False):
     """
     Create a HTTP server that listens and respond to queries for the given
     hostname under the given port, using the request handler above. Runs in an
@@ -1044,15 +2692,22 @@ def server_loop(hostname, port,
 
     server_address = (hostname, port)
     request_handler_class = MakeRequestHandler(
-            backend_1, backend_2, timeout_normal, qlever_name_service)
+            backend_1, backend_2, timeout_normal, qlever_name_service,
+            response_cache)
     # NEW 23.02.2021: Threaded server. All that was needed was writing
     # ThreadingHTTPServer instead of HTTPServer, wow. However, this required
     # upgrading to Python 3.7, which gave a minor problem with a regex
-    # substitute string in this code, namely "\\S+:\\1". Adding an additional
-    # backslash to make it "\\\S+:\\\1" solved the problem.
-    server = http.server.ThreadingHTTPServer(server_address, request_handler_class)
+    # substitute string in this code, namely "\\S+:\\1". An additional
+    # backslash ("\\\S+:\\\1") made the error go away, but the resulting
+    # regex never matched. It is a raw string now, see the NOTE in
+    # ConfigForAddTriple.__init__.
+    #
+    # NEW: The number of threads is now bounded, see BoundedThreadingHTTPServer.
+    server = BoundedThreadingHTTPServer(
+            server_address, request_handler_class, max_workers, max_queued,
+            reuse_port)
     log.info("Listening to GET requests on \x1b[1m%s:%d\x1b[0m"
-                 % (socket.getfqdn(), port))
+                 " with %d worker threads", socket.getfqdn(), port, max_workers)
     server.serve_forever()
 
 class MyArgumentParser(argparse.ArgumentParser):
@@ -1117,6 +2772,48 @@ if __name__ == "__main__":
             " subject variable name to derive the new variable name"
             " (can be empty), and position is the placement of the new"
             " variable in the SELECT clause of the SPARQL query")
+    parser.add_argument(
+            "--name-service-cache-size", dest="name_service_cache_size",
+            type=int, default=4096,
+            help="Maximal number of probe results cached by the name service"
+            " (cleared when the proxy receives cmd=clear-cache)")
+    parser.add_argument(
+            "--name-service-cache-ttl", dest="name_service_cache_ttl",
+            type=float, default=0,
+            help="Time in seconds after which a cached probe result is no"
+            " longer used (0 means forever)")
+    parser.add_argument(
+            "--cache-size", dest="cache_size", type=int, default=0,
+            help="Maximal number of responses to SPARQL queries cached by the"
+            " proxy (default: 0 = no caching; the cache is cleared when the"
+            " proxy receives cmd=clear-cache, but a cached response can be"
+            " stale for up to --cache-ttl seconds when the backend data"
+            " changes otherwise)")
+    parser.add_argument(
+            "--cache-ttl", dest="cache_ttl", type=float, default=300.0,
+            help="Time in seconds after which a cached response is no longer"
+            " used (0 means forever)")
+    parser.add_argument(
+            "--cache-max-bytes", dest="cache_max_bytes", type=int,
+            default=1000 * 1000 * 1000,
+            help="Maximal total size in bytes of the responses cached by the"
+            " proxy (the least recently used ones are evicted first)")
+    parser.add_argument(
+            "--max-workers", dest="max_workers", type=int, default=32,
+            help="Maximal number of requests handled in parallel (this is"
+            " also the size of the connection pool for each backend, twice"
+            " that if the two backends share a pool)")
+    parser.add_argument(
+            "--max-queued", dest="max_queued", type=int, default=256,
+            help="Maximal number of requests waiting for a free worker, further"
+            " requests get a 503 Service Unavailable right away (0 means no"
+            " limit)")
+    parser.add_argument(
+            "--reuse-port", dest="reuse_port",
+            action="store_true", default=False,
+            help="Allow several instances of the proxy to listen on the same"
+            " port (SO_REUSEPORT), for using more than one CPU core. Note that"
+            " each instance has its own caches")
     parser.add_argument(
             "--log-level", dest="log_level", type=str,
             choices=["INFO", "DEBUG", "ERROR"], default="INFO",
@@ -1140,17 +2837,28 @@ if __name__ == "__main__":
     args = parser.parse_args(sys.argv[1:])
     log.setLevel(eval("logging.%s" % args.log_level))
     print()
-    log.info("Log level is \x1b[1m%s\x1b[0m" % args.log_level)
+    log.info("Log level is \x1b[1m%s\x1b[0m", args.log_level)
 
     # Create Backend 1. The third argument is the id (1 = primary, 2 = fallback)
-    backend_1 = Backend(args.backend_1, args.timeout_1, 1)
+    # The connection pool of each backend gets as many connections as there
+    # are worker threads, so that the workers do not have to wait for each
+    # other. If Backend 2 has the same host and port, it uses the same pool
+    # (see Backend.__init__), which then needs room for the connections of
+    # both (otherwise, urllib3 opens additional connections when the pool is
+    # empty and discards them afterwards, each with a new TLS handshake).
+    same_netloc = not args.backend_2 or \
+            urllib.parse.urlparse(args.backend_1).netloc == \
+            urllib.parse.urlparse(args.backend_2).netloc
+    backend_1 = Backend(args.backend_1, args.timeout_1, 1,
+            max_pool_size=(2 if same_netloc else 1) * args.max_workers)
     backend_1.show_cache_stats()
 
     # Create Backend 2. If not specified, same as Backend 1.
     backend_2 = Backend(
             args.backend_2 if args.backend_2 else args.backend_1,
             args.timeout_2, 2,
-            args.pin_results_2, args.clear_cache_2, args.show_cache_stats_2)
+            args.pin_results_2, args.clear_cache_2, args.show_cache_stats_2,
+            args.max_workers, shared_backend=backend_1)
     # log.info("Backend 2: Are results and subtrees pinned? " +
     #            ("YES" if args.pin_results_2 else "NO"))
     if args.backend_2 != "":
@@ -1159,8 +2867,8 @@ if __name__ == "__main__":
             log.info("Backend 2: To clear pinned queries from cache, "
                      "start with option --clear-cache-2")
 
-    log.info("Timeout for single-backend queries is %.1fs" %
-            args.timeout_normal)
+    log.info("Timeout for single-backend queries is %.1fs",
+             args.timeout_normal)
 
     # Parse arguments to --add-triple into ConfigForAddTriple objects.
     configs_for_add_triple = []
@@ -1179,18 +2887,38 @@ if __name__ == "__main__":
     # Create Qlever Name Service (None if no --add-triple is specified).
     if len(configs_for_add_triple) > 0:
         qlever_name_service = QleverNameService(
-                backend_2, args.subject_var_suffix, configs_for_add_triple)
+                backend_2, args.subject_var_suffix, configs_for_add_triple,
+                args.name_service_cache_size,
+                args.name_service_cache_ttl if args.name_service_cache_ttl > 0
+                    else None)
         log.info("Name Service \x1b[1mAVAILABLE\x1b[0m"
                  " (for queries to Backend 1 with name_service=true)"
                  ", configs are:")
         for config in configs_for_add_triple:
-            log.info("\x1b[90m" + str(config) + "\x1b[0m")
+            log.info("\x1b[90m%s\x1b[0m", config)
     else:
         qlever_name_service = None
         log.info("Name Service \x1b[1mNOT available\x1b[0m"
                  " -> see usage info (--help) for how to activate")
 
+    # Create the response cache (None if --cache-size is 0).
+    if args.cache_size > 0:
+        # NOTE: As for --name-service-cache-ttl, a TTL of 0 means no TTL (and
+        # not that every entry expires right away).
+        response_cache = LruCache(args.cache_size,
+                args.cache_ttl if args.cache_ttl > 0 else None,
+                args.cache_max_bytes)
+        log.info("Response cache with up to %d entries and %.1f MB, TTL %s",
+                 args.cache_size, args.cache_max_bytes / 1e6,
+                 "%.0fs" % args.cache_ttl if args.cache_ttl > 0 else "none")
+    else:
+        response_cache = None
+        log.info("Response cache \x1b[1mdisabled\x1b[0m"
+                 " -> see usage info (--help) for how to activate")
+
     # Listen and respond to queries at that port, no matter to which hostname on
     # this machine the were directed.
     server_loop("0.0.0.0", args.port,
-            backend_1, backend_2, args.timeout_normal, qlever_name_service)
+            backend_1, backend_2, args.timeout_normal, qlever_name_service,
+            args.max_workers, response_cache, args.max_queued,
+            args.reuse_port)